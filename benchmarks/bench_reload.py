@@ -0,0 +1,210 @@
+"""
+Benchmark reload latency as a function of heap size and module size.
+
+Synthetic modules with a number of functions and classes are generated
+in a temporary directory, then a synthetic heap holds references to them
+through lists, tuples, dicts, sets, subclasses and instances. The time
+of reimport(), modified(), _swap_refs() and _remove_refs() is measured
+for every combination of sizes.
+
+Results are written as json, so runs from different commits can be
+compared with --compare.
+
+    python benchmarks/bench_reload.py --functions 10 300 --heap 0 1000000
+    python benchmarks/bench_reload.py --output new.json --compare old.json
+"""
+
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reimport
+from reimport._reimport import _swap_refs, _remove_refs
+
+
+
+def write_module(filename, functions, classes, version):
+    """Write a module with the given number of functions and classes"""
+    lines = []
+    for i in range(functions):
+        lines.append("def func_%d(a, b=%d):" % (i, version))
+        lines.append("    return a + b + %d" % i)
+        lines.append("")
+    for i in range(classes):
+        lines.append("class Class_%d(object):" % i)
+        lines.append("    value = %d" % version)
+        lines.append("    def method(self):")
+        lines.append("        return self.value + %d" % i)
+        lines.append("")
+    with open(filename, "w") as f:
+        f.write("\n".join(lines))
+
+
+
+def build_heap(module, size):
+    """Build size objects, one in ten referring to the module's functions
+        and classes through a different kind of container"""
+    funcs = [v for n, v in sorted(vars(module).items()) if n.startswith("func_")]
+    classes = [v for n, v in sorted(vars(module).items()) if n.startswith("Class_")]
+    heap = []
+    for i in range(size):
+        func = funcs[i % len(funcs)] if funcs else None
+        klass = classes[i % len(classes)] if classes else None
+        kind = i % 10
+        if kind == 0 and func:
+            heap.append([func, i])
+        elif kind == 1 and func:
+            heap.append((func, i))
+        elif kind == 2 and func:
+            heap.append({"callback": func, "index": i})
+        elif kind == 3 and func:
+            heap.append(set([func]))
+        elif kind == 4 and klass:
+            heap.append(klass())
+        elif kind == 5 and klass and i % 1000 == 5:
+            heap.append(type("Sub_%d" % i, (klass,), {}))
+        else:
+            heap.append({"filler": i})
+    return heap
+
+
+
+def timed(func, repeat):
+    """Best wall clock time of func over repeat runs, and its last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+
+def bench_sizes(workdir, functions, classes, heap_size, repeat):
+    """Run every benchmark for one combination of sizes"""
+    name = "bench_mod_%d_%d_%d" % (functions, classes, heap_size)
+    filename = os.path.join(workdir, name + ".py")
+    write_module(filename, functions, classes, 0)
+    past = time.time() - 10
+    os.utime(filename, (past, past))
+    module = __import__(name)
+    heap = build_heap(module, heap_size)
+    gc.collect()
+    sizes = {"functions": functions, "classes": classes, "heap": heap_size}
+    results = []
+
+    # Steady state scan, nothing has changed
+    reimport.modified()
+    seconds, _ = timed(reimport.modified, repeat)
+    results.append(dict(sizes, benchmark="modified", seconds=seconds))
+
+    # Reload with every function and class changed
+    def reload():
+        reload.version += 1
+        write_module(filename, functions, classes, reload.version)
+        return reimport.reimport(name)
+    reload.version = 0
+    seconds, stats = timed(reload, repeat)
+    results.append(dict(sizes, benchmark="reimport", seconds=seconds,
+                        phases=stats.phases, counts=stats.counts))
+
+    # Single object swaps and removals through the whole heap
+    def old():
+        pass
+    def new():
+        pass
+    holders = [[old] for _ in range(10)]
+    seconds, _ = timed(lambda: _swap_refs(old, new, ()), repeat)
+    results.append(dict(sizes, benchmark="_swap_refs", seconds=seconds))
+
+    holders = [[old] for _ in range(10)]
+    seconds, _ = timed(lambda: _remove_refs(old, ()), repeat)
+    results.append(dict(sizes, benchmark="_remove_refs", seconds=seconds))
+
+    del heap, holders, module
+    sys.modules.pop(name, None)
+    return results
+
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=os.path.dirname(__file__),
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+
+def compare(results, previous):
+    """Print the ratio of new to previous times for matching benchmarks"""
+    def key(result):
+        return (result["benchmark"], result["functions"], result["classes"],
+                result["heap"])
+    before = dict((key(r), r["seconds"]) for r in previous["results"])
+    print("%-14s %9s %7s %9s %10s %10s %7s" % ("benchmark", "functions",
+          "classes", "heap", "before", "after", "ratio"))
+    for result in results:
+        old = before.get(key(result))
+        if not old:
+            continue
+        print("%-14s %9d %7d %9d %10.4f %10.4f %6.2fx" % (key(result) + (
+              old, result["seconds"], result["seconds"] / old)))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--functions", type=int, nargs="+", default=[10, 300])
+    parser.add_argument("--classes", type=int, nargs="+", default=[10])
+    parser.add_argument("--heap", type=int, nargs="+", default=[0, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write json results to this file")
+    parser.add_argument("--compare", help="json results of a previous run")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="reimport-bench-")
+    sys.path.insert(0, workdir)
+    results = []
+    try:
+        for heap_size in args.heap:
+            for functions in args.functions:
+                for classes in args.classes:
+                    for result in bench_sizes(workdir, functions, classes,
+                                              heap_size, args.repeat):
+                        print("%-14s functions=%-5d classes=%-5d heap=%-8d %.4fs" % (
+                              result["benchmark"], functions, classes,
+                              heap_size, result["seconds"]))
+                        results.append(result)
+    finally:
+        sys.path.remove(workdir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"commit": git_commit(), "python": platform.python_version(),
+              "platform": platform.platform(), "repeat": args.repeat,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+
+if __name__ == "__main__":
+    main()
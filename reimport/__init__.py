@@ -1,2 +1,17 @@
 from ._reimport import reimport
-from ._reimport import modified
\ No newline at end of file
+from ._reimport import modified
+from ._reimport import Watcher
+from ._reimport import AutoReloader
+from ._reimport import ReimportStats
+from ._reimport import ReimportScope
+from ._reimport import track_instances
+from ._reimport import reload_barrier
+from ._reimport import reimport_async
+from ._reimport import modified_async
+from ._reimport import plan_reimport
+from ._reimport import ReimportPlan
+from ._reimport import SharedState
+from ._reimport import FleetCoordinator
+from ._reimport import FleetWorker
+from ._reimport import FleetReport
+from ._reimport import ReimportCanaryError
@@ -0,0 +1,60 @@
+"""
+Runs a function in a forked child process and brings its result back to
+the parent through a pipe, as json. Reimport uses this to try a reload
+in a copy of the process before changing the real one.
+"""
+
+
+import os
+import json
+import time
+import select
+import signal
+import traceback
+
+
+
+def run_in_child(func, timeout=None):
+    """Fork, call func in the child and return what it returned, a json
+        serializable dict. Raises OSError when the child dies or does not
+        answer within timeout seconds, in which case it is killed."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # The child never returns into the caller's code
+        status = 1
+        try:
+            os.close(read_fd)
+            data = json.dumps(func()).encode("utf-8")
+            while data:
+                data = data[os.write(write_fd, data):]
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    chunks = []
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    os.kill(pid, signal.SIGKILL)
+                    raise OSError("Canary process %d timed out" % pid)
+            if not select.select([read_fd], [], [], remaining)[0]:
+                continue
+            data = os.read(read_fd, 65536)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        os.close(read_fd)
+        _, status = os.waitpid(pid, 0)
+
+    if status or not chunks:
+        raise OSError("Canary process %d died with status %d" % (pid, status))
+    return json.loads(b"".join(chunks).decode("utf-8"))
@@ -0,0 +1,60 @@
+"""
+Framing for the messages a reimport coordinator and its workers send
+over a Unix domain socket. Each message is one line of json.
+"""
+
+
+import json
+import socket
+
+
+
+def listen(address):
+    """Non blocking server socket bound to the Unix socket address"""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(address)
+        server.listen(128)
+        server.setblocking(False)
+    except OSError:
+        server.close()
+        raise
+    return server
+
+
+
+def connect(address):
+    """Socket connected to the Unix socket address"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+
+def send_message(sock, message):
+    """Send one message, a json serializable dict"""
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+
+class MessageReader(object):
+    """Collects lines from a socket into messages"""
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b""
+
+
+    def read(self):
+        """Read what has arrived and return the complete messages. This
+            blocks until some data arrives, and raises EOFError once the
+            other side has closed the connection."""
+        data = self.sock.recv(65536)
+        if not data:
+            raise EOFError("Connection closed")
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        return [json.loads(line.decode("utf-8")) for line in lines if line]
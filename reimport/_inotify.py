@@ -0,0 +1,100 @@
+"""
+Minimal ctypes binding to the Linux inotify API. This is used by the
+reimport Watcher to learn about changed source files without polling.
+Creating an Inotify raises OSError when the API is not available.
+"""
+
+
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+
+# Events that mean a file in a watched directory has new contents
+IN_SOURCE_CHANGED = IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB
+
+
+_event_header = struct.Struct("iIII")
+_libc = None
+
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+
+def _check(result):
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+
+class Inotify(object):
+    """An inotify instance. Use fileno() with select to wait for events"""
+    def __init__(self):
+        self._libc = _load_libc()
+        self._fd = _check(self._libc.inotify_init1(IN_CLOEXEC))
+
+
+    def fileno(self):
+        return self._fd
+
+
+    def add_watch(self, path, mask=IN_SOURCE_CHANGED):
+        """Watch a directory, returns the watch descriptor"""
+        path = os.fsencode(path)
+        return _check(self._libc.inotify_add_watch(self._fd, path,
+                                                   mask | IN_ONLYDIR))
+
+
+    def rm_watch(self, wd):
+        try:
+            _check(self._libc.inotify_rm_watch(self._fd, wd))
+        except OSError:
+            pass  # Already gone with its directory
+
+
+    def read_events(self):
+        """Read available events as a list of (wd, mask, name) tuples.
+            This blocks until at least one event is available."""
+        data = os.read(self._fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -13,7 +13,11 @@ http://code.google.com/p/reimport .
 """
 
 
-__all__ = ["reimport", "modified"]
+__all__ = ["reimport", "modified", "Watcher", "AutoReloader", "ReimportStats",
+           "ReimportScope", "track_instances", "reload_barrier",
+           "reimport_async", "modified_async", "plan_reimport", "ReimportPlan",
+           "SharedState", "FleetCoordinator", "FleetWorker", "FleetReport",
+           "ReimportCanaryError"]
 
 
 import sys
@@ -24,6 +28,16 @@ import inspect
 import weakref
 import traceback
 import time
+import select
+import dis
+import hashlib
+import struct
+import marshal
+import heapq
+import bisect
+import itertools
+import importlib.machinery
+import importlib.util
 
 
 
@@ -38,6 +52,57 @@ __url__ = "https://github.com/grongierisc/reimport-ng"
 _previous_scan_time = time.time() - 1.0
 _module_timestamps = {}
 
+# Size and hash of the source each module was last loaded from, for
+# modified(content_hash=True)
+_module_hashes = {}     # module name -> (size, digest)
+_hash_chunk_size = 1 << 16
+
+# Index of loaded source files, maintained incrementally by modified()
+_module_index = {}      # module name -> normalized source filename
+_directory_index = {}   # directory -> {file basename -> [module names]}
+_sorted_module_names = []   # indexed module names, for prefix searches
+
+# Held while the index is updated or read through, the watcher and
+# reloader threads use it too
+_index_lock = threading.RLock()
+
+# The started Watcher that modified() drains, if any
+_watcher = None
+
+# Normalized source filenames, memoized during a reimport
+_source_paths = {}      # filename -> normalized source filename
+
+# Identity index of sys.modules, for module objects that are not
+# loaded under their own name. Rebuilt when a lookup misses.
+_module_names = {}      # id(module) -> module name
+
+# Instances of classes decorated with track_instances are moved to the
+# new class this many at a time, letting other threads run in between
+_instance_chunk_size = 10000
+
+# Seconds reimport(canary=True) waits for the trial in the forked child
+_canary_timeout = 60.0
+
+# One asyncio.Lock per event loop, so reimport_async calls on a loop
+# do not interleave. All of them run on the loop's thread, which the
+# reload barrier lets in again.
+_async_locks = weakref.WeakKeyDictionary()  # loop -> asyncio.Lock
+
+# Objects searched for referrers between checks of the max_pause
+_search_chunk_size = 1000
+
+# gc.get_referrers checks every referent against each of its arguments.
+# Searching for more objects than this walks the heap with an id set.
+_direct_referrers_limit = 8
+
+# Graph of which loaded modules import from which, built on first use
+# by reimport(dependents=True) and then kept up to date
+_module_imports = {}    # module name -> names of modules it imports from
+_module_importers = {}  # module name -> names of modules importing from it
+
+
+_ModuleType = type(sys)
+
 
 # find the 'instance' old style type
 class _OldClass: 
@@ -47,7 +112,8 @@ del _OldClass
 
 
 
-def reimport(*modules):
+def reimport(*modules, write_bytecode=False, executor=None, dependents=False,
+              scope=None, max_pause=None, skip_unchanged=False, canary=False):
     """Reimport python modules. Multiple modules can be passed either by
         name or by reference. Only pure python modules can be reimported.
         
@@ -66,59 +132,470 @@ def reimport(*modules):
         then cleanup will be disabled for only that module. Any exceptions
         raised during the callback will be handled by traceback.print_exc,
         similar to what happens with tracebacks in the __del__ method.
+        
+        Sources are compiled once, by the SyntaxError check, and that code
+        is used for the import. Pass write_bytecode=True to also store it
+        as the usual __pycache__ file.
+        
+        Reading and compiling can be spread over a concurrent.futures
+        executor. A ProcessPoolExecutor suits the CPU bound compile, a
+        ThreadPoolExecutor suits slow filesystems.
+        
+        With dependents=True, loaded modules that import from the
+        reimported modules, directly or indirectly, are reimported as
+        well. Modules are then reloaded after the modules they import.
+        
+        References to the old objects are searched for in the whole heap.
+        Pass a ReimportScope, or a list of root containers, as scope to
+        only search what is reachable from those roots.
+        
+        Modules are changed while holding reload_barrier. Threads that
+        enter the barrier are kept out until the reimport is done. Give
+        max_pause in seconds to search and patch references in chunks
+        of about that length, letting other threads run in between.
+        
+        With skip_unchanged=True, module level functions and classes with
+        the same code, defaults and members as before are not rejiggered.
+        Those that never read or write module globals are kept as they
+        are, only the few references to their new copies are moved back
+        to them. References to the others still move to the new objects,
+        which use the globals of the new module, but the old objects are
+        left as they were instead of being patched to match.
+        
+        With canary=True the whole reimport is first tried in a forked
+        child process, running the module code, the __reimported__
+        callbacks and the rejigger. This process is only reimported if
+        the child succeeded, otherwise ReimportCanaryError is raised
+        with the child's error and stats. Only the calling thread is
+        copied into the child. Give canary as a number of seconds to
+        limit how long the child may take.
+        
+        Returns a ReimportStats with the time spent in each phase and
+        counters of what was rejiggered and patched.
         """
-    __internal_swaprefs_ignore__ = "reimport"
-    reload_set = set()
+    if canary and modules:
+        options = dict(write_bytecode=write_bytecode, executor=executor,
+                       dependents=dependents, scope=scope,
+                       max_pause=max_pause, skip_unchanged=skip_unchanged)
+        return _canary_reimport(modules, canary, options)
 
-    if not modules:
-        return
+    stats = ReimportStats()
+    if scope is not None and not isinstance(scope, ReimportScope):
+        scope = ReimportScope(scope)
 
-    # Get names of all modules being reloaded
-    for module in modules:
-        name, target = _find_exact_target(module)
-        if not target:
-            raise ValueError("Module %r not found" % module)
-        if not _is_code_module(target):
-            raise ValueError("Cannot reimport extension, %r" % name)
+    if not modules:
+        return stats
 
-        reload_set.update(_find_reloading_modules(name))
+    stats.start("find")
+    reload_names = _find_reload_names(modules, dependents)
 
-    # Sort module names 
-    reload_names = _package_depth_sort(reload_set, False)
+    stats.start("precheck")
 
     # Check for SyntaxErrors ahead of time. This won't catch all
     # possible SyntaxErrors or any other ImportErrors. But these
     # should be the most common problems, and now is the cleanest
     # time to abort.
-    # I know this gets compiled again anyways. It could be
-    # avoided with py_compile, but I will not be the creator
-    # of messy .pyc files!
+    # The code is kept and served to the import, so nothing gets
+    # compiled twice. No .pyc files are written unless asked for.
+    pynames = _source_names(reload_names)
+
+    # Errors are raised in reload_names order, even from an executor
+    marshalled = _is_process_pool(executor)
+    if executor is None:
+        results = map(_precompile, pynames.values())
+    else:
+        results = executor.map(_precompile, pynames.values(),
+                               itertools.repeat(marshalled))
+    precompiled = _precompiled_modules(pynames, results, marshalled)
+    results = None
+
+    for _ in _reimport_steps(reload_names, precompiled, write_bytecode,
+                             stats, scope, max_pause, skip_unchanged):
+        time.sleep(0)
+    return stats
+
+
+
+def _canary_reimport(modules, timeout, options):
+    """Try a reimport in a forked child, then apply it here if it worked"""
+    from ._canary import run_in_child
+    if not hasattr(os, "fork"):
+        raise ReimportCanaryError("Canary reimport needs os.fork")
+    if timeout is True:
+        timeout = _canary_timeout
+
+    def trial():
+        # Executor threads are not copied into the child, and the
+        # bytecode is written by the real reimport
+        try:
+            stats = reimport(*modules, **dict(options, executor=None,
+                                              write_bytecode=False))
+        except Exception as e:
+            return {"error": "%s: %s" % (type(e).__name__, e), "stats": None}
+        error = None
+        if stats.counts.get("callback_errors"):
+            error = "%d __reimported__ callbacks raised" % (
+                        stats.counts["callback_errors"])
+        return {"error": error, "stats": stats.as_dict()}
+
+    start = time.perf_counter()
+    try:
+        result = run_in_child(trial, timeout)
+    except OSError as e:
+        raise ReimportCanaryError(str(e))
+    elapsed = time.perf_counter() - start
+    if result["error"]:
+        raise ReimportCanaryError(result["error"], result["stats"])
+
+    stats = reimport(*modules, **options)
+    stats.canary = result["stats"]
+    stats.phases = dict([("canary", elapsed)] + list(stats.phases.items()))
+    return stats
+
+
+
+async def reimport_async(*modules, write_bytecode=False, executor=None,
+                         dependents=False, scope=None, max_pause=0.005,
+                         skip_unchanged=False):
+    """Reimport python modules without blocking the running event loop.
+        Takes the same arguments as reimport. Finding and compiling the
+        sources runs in an executor, the loop's default one unless given.
+        Modules are then changed from the loop, returning to it each
+        time max_pause seconds have passed. Coroutines run between those
+        chunks, while the reload barrier is held, so they should check
+        reload_barrier.reloading before using reimported code.
+        
+        Calls on the same event loop run one after the other.
+        
+        Returns the same ReimportStats as reimport.
+        """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    lock = _async_locks.get(loop)
+    if lock is None:
+        lock = _async_locks[loop] = asyncio.Lock()
+    async with lock:
+        return await _reimport_async(loop, modules, write_bytecode, executor,
+                                     dependents, scope, max_pause,
+                                     skip_unchanged)
+
+
+
+async def _reimport_async(loop, modules, write_bytecode, executor, dependents,
+                          scope, max_pause, skip_unchanged):
+    """Body of reimport_async, run while holding the loop's lock"""
+    import asyncio
+    stats = ReimportStats()
+    if scope is not None and not isinstance(scope, ReimportScope):
+        scope = ReimportScope(scope)
+
+    if not modules:
+        return stats
+
+    stats.start("find")
+    reload_names = await loop.run_in_executor(None, _find_reload_names,
+                                              modules, dependents)
+
+    stats.start("precheck")
+    pynames = _source_names(reload_names)
+    marshalled = _is_process_pool(executor)
+    results = await asyncio.gather(*[
+                    loop.run_in_executor(executor, _precompile, pyname, marshalled)
+                    for pyname in pynames.values()], return_exceptions=True)
+
+    # Errors are raised in reload_names order, like reimport
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    precompiled = _precompiled_modules(pynames, results, marshalled)
+    results = None
+
+    steps = _reimport_steps(reload_names, precompiled, write_bytecode,
+                            stats, scope, max_pause, skip_unchanged)
+    try:
+        for _ in steps:
+            await asyncio.sleep(0)
+    except asyncio.CancelledError:
+        # Half a reimport is worse than a late one
+        for _ in steps:
+            pass
+        raise
+    return stats
+
+
+
+def plan_reimport(*modules, dependents=False):
+    """Work out what a reimport of the same modules would do, without
+        changing anything. The sources are compiled and their definitions
+        compared with the loaded modules, but no module code is run.
+        
+        Returns a ReimportPlan with the functions and classes that would
+        change or be removed, the referrers the swap phase would find
+        for each of them, and the expected pause.
+        """
+    __internal_swaprefs_ignore__ = "plan_reimport"
+    plan = ReimportPlan()
+    if not modules:
+        return plan
+
+    plan.modules = _find_reload_names(modules, dependents)
+    pynames = _source_names(plan.modules)
+    objects = {}    # id(obj) -> obj, for everything swapped or removed
+    names = {}      # id(obj) -> dotted name
+    ignores = set((id(objects),))
+    try:
+        for name in plan.modules:
+            module = sys.modules[name]
+            objects[id(module)] = module
+            names[id(module)] = name
+            ignores.add(id(_safevars(module)))
+            try:
+                result = _precompile(pynames[name]) if name in pynames else None
+            except Exception as e:
+                plan.errors[name] = "%s: %s" % (type(e).__name__, e)
+                continue
+            if result is not None:
+                _plan_module(plan, module, result[1], objects, names, ignores)
+        module = result = None
+    finally:
+        _source_paths.clear()
+
+    # Time the same search the swap phase makes. Going through every
+    # referrer once more stands in for patching them.
+    batch = _SwapBatch(ignores)
+    for obj in objects.values():
+        batch.remove(obj)
+    started = time.perf_counter()
+    referrers = batch.search()
+    counts = dict.fromkeys(objects, 0)
+    for container in referrers:
+        for obj in gc.get_referents(container):
+            if id(obj) in counts:
+                counts[id(obj)] += 1
+    plan.pause = time.perf_counter() - started
+    batch = container = referrers = None
+    plan.referrers = dict((names[key], count) for key, count in counts.items())
+    return plan
+
+
+
+def _plan_module(plan, module, code, objects, names, ignores):
+    """Compare the functions and classes of a loaded module with the
+        definitions in its new code, the same way _rejigger_module
+        matches them up by name."""
+    bindings = _code_bindings(code)
+    module_vars = _safevars(module)
+    filename = module.__file__
+    for name, value in list(module_vars.items()):
+        if not (inspect.isclass(value) or inspect.isfunction(value)):
+            continue
+        if not _from_file(filename, value):
+            continue
+        dotted = "%s.%s" % (module.__name__, name)
+        if name not in bindings:
+            plan.removed.append(dotted)
+        elif _definition_changed(value, bindings[name]):
+            plan.changed.append(dotted)
+        else:
+            plan.unchanged.append(dotted)
+        _plan_targets(value, dotted, objects, names, ignores)
+
+    for name, new in bindings.items():
+        if inspect.iscode(new) and name not in module_vars:
+            plan.added.append("%s.%s" % (module.__name__, name))
+
+
+
+def _plan_targets(value, dotted, objects, names, ignores):
+    """Add a function or class, and the members of a class, to the
+        objects that would be swapped"""
+    objects[id(value)] = value
+    names[id(value)] = dotted
+    if not inspect.isclass(value):
+        return
+    # The class namespace is not patched, like in _rejigger_class
+    ignores.update(id(ref) for ref in gc.get_referents(vars(value)))
+    for name, member in list(vars(value).items()):
+        if inspect.isfunction(member) or (inspect.isclass(member) and
+                                          member.__module__ == value.__module__):
+            _plan_targets(member, "%s.%s" % (dotted, name), objects, names,
+                          ignores)
+
+
+
+# Bindings whose value is not known without running the code
+_unknown = object()
+
+# Instructions that read or write module globals, or builtins
+_global_opnames = frozenset(("LOAD_GLOBAL", "STORE_GLOBAL", "DELETE_GLOBAL"))
+
+# Names type() adds to a class, or that reimport manages itself
+_class_internals = frozenset(("__module__", "__qualname__", "__doc__",
+                              "__dict__", "__weakref__", "__firstlineno__",
+                              "__static_attributes__", "__classcell__",
+                              "__reimport_instances__"))
+
+
+
+def _code_bindings(code):
+    """Names bound by a module or class body. Each maps to the code of
+        the function or class defined under that name, to the constant
+        assigned to it, or to _unknown.
+        """
+    bindings = {}
+    previous = pending = None
+    for instruction in dis.get_instructions(code):
+        opname = instruction.opname
+        if opname in ("STORE_NAME", "STORE_GLOBAL"):
+            name = instruction.argval
+            if pending is not None and pending.co_name == name:
+                bindings[name] = pending
+            elif previous is not None and previous.opname == "LOAD_CONST":
+                bindings[name] = previous.argval
+            else:
+                bindings[name] = _unknown
+            pending = None
+        elif opname in ("DELETE_NAME", "DELETE_GLOBAL"):
+            bindings.pop(instruction.argval, None)
+        elif opname == "LOAD_CONST" and inspect.iscode(instruction.argval):
+            pending = instruction.argval
+        previous = instruction
+    return bindings
+
+
+
+def _definition_changed(old, new):
+    """Test if a loaded function or class differs from its new code"""
+    if not inspect.iscode(new):
+        return True
+    if inspect.isclass(old):
+        return _class_changed(old, new)
+    return _code_changed(_function_code(old), new)
+
+
+
+def _class_changed(old, body):
+    """Test if a loaded class differs from the code of its new body"""
+    bindings = _code_bindings(body)
+    doc = bindings.get("__doc__")
+    if doc is _unknown or doc != old.__doc__:
+        return True
+
+    seen = set(_class_internals)
+    for name, value in vars(old).items():
+        if name in _class_internals:
+            continue
+        if inspect.ismemberdescriptor(value) or inspect.isgetsetdescriptor(value):
+            continue
+        seen.add(name)
+        new = bindings.get(name, _unknown)
+        if new is _unknown:
+            return True
+        if inspect.iscode(new):
+            if inspect.isclass(value):
+                if _class_changed(value, new):
+                    return True
+            elif _code_changed(_function_code(value), new):
+                return True
+        elif type(new) is not type(value) or new != value:
+            return True
+    return bool(set(bindings) - seen)
+
+
+
+def _code_changed(old, new):
+    """Test if code changed, other than moving to different lines"""
+    if old is None:
+        return True
+    return _code_fingerprint(old) != _code_fingerprint(new)
+
+
+
+def _function_code(value):
+    """Code of a function, or of the function inside a staticmethod,
+        classmethod or property"""
+    value = getattr(value, "__func__", value)
+    value = getattr(value, "fget", value)
+    return getattr(value, "__code__", None)
+
+
+
+def _is_process_pool(executor):
+    """Whether the executor runs in other processes, so results must be
+        marshalled. Avoids importing concurrent.futures for the check."""
+    futures = sys.modules.get("concurrent.futures")
+    return (futures is not None and
+            isinstance(executor, futures.ProcessPoolExecutor))
+
+
+
+def _find_reload_names(modules, dependents):
+    """Names of all modules being reloaded, in the order to reload them"""
+    with _index_lock:
+        reload_set = set()
+        _source_paths.clear()
+        _update_module_index()
+        package_flags = {}
+        for module in modules:
+            name, target = _find_exact_target(module, package_flags)
+            if not target:
+                raise ValueError("Module %r not found" % module)
+            if not _is_code_module(target):
+                raise ValueError("Cannot reimport extension, %r" % name)
+
+            reload_set.update(_find_reloading_modules(name))
+
+        # Sort module names 
+        if dependents:
+            _add_dependent_modules(reload_set, package_flags)
+            return _dependency_sort(reload_set)
+        return _package_depth_sort(reload_set, False)
+
+
+
+def _source_names(reload_names):
+    """Source file of each module being reloaded, by module name"""
+    pynames = {}
     for name in reload_names:
         filename = getattr(sys.modules[name], "__file__", None)
-        if not filename:
-            continue
-        pyname = os.path.splitext(filename)[0] + ".py"
-        try:
-            data = open(pyname, "r", encoding="utf-8").read() + "\n"
-        except (IOError, OSError):
+        if filename:
+            pynames[name] = os.path.splitext(filename)[0] + ".py"
+    return pynames
+
+
+
+def _precompiled_modules(pynames, results, marshalled):
+    """Pair the results of _precompile with their modules, for the
+        _PrecompiledFinder"""
+    precompiled = {}
+    for (name, pyname), result in zip(pynames.items(), results):
+        if result is None:
             continue
-        
-        compile(data, pyname, "exec", 0, False)  # Let this raise exceptions
+        file_stats, code, digest = result
+        if marshalled:
+            code = marshal.loads(code)
+        precompiled[name] = (pyname, file_stats, code, digest)
+    return precompiled
+
+
+
+def _reimport_steps(reload_names, precompiled, write_bytecode, stats, scope,
+                    max_pause, skip_unchanged):
+    """Change the modules of a reimport. This is a generator that yields
+        whenever max_pause has been used up, so the caller can let other
+        work run before continuing."""
+    __internal_swaprefs_ignore__ = "reimport"
+    digests = dict((name, (entry[1].st_size, entry[3]))
+                   for name, entry in precompiled.items())
+    precompiled_finder = _PrecompiledFinder(precompiled, write_bytecode)
 
     clear_type_cache = getattr(sys, "_clear_type_cache", None)
     if clear_type_cache:
         clear_type_cache()
 
-    # Begin changing things. We "grab the GIL", so other threads
-    # don't get a chance to see our half-baked universe
-    # Create a lock object
-    gil_lock = threading.Lock()
-
-    # Acquire the lock
-    #gil_lock.acquire()
-
-    # prev_interval = sys.getswitchinterval()
-    # sys.setswitchinterval(sys.maxsize)
+    # Begin changing things. Threads using the reload barrier don't
+    # get a chance to see our half-baked universe
+    reload_barrier._acquire()
     try:
 
         # Python will munge the parent package on import. Remember original value
@@ -141,6 +618,8 @@ def reimport(*modules):
         prev_names = set(sys.modules)
 
         # Reimport modules, trying to rollback on exceptions
+        stats.start("import")
+        sys.meta_path.insert(0, precompiled_finder)
         try:
             try:
                 for name in reload_names:
@@ -151,16 +630,23 @@ def reimport(*modules):
                 # Try to dissolve any newly import modules and revive the old ones
                 new_names = set(sys.modules) - prev_names
                 new_names = _package_depth_sort(new_names, True)
+                stats.start("rollback")
+                batch = _SwapBatch(ignores, stats, scope, max_pause)
                 for name in new_names:
                     backout_module = sys.modules.pop(name, None)
                     if backout_module is not None:
-                        _unimport(backout_module, ignores)
+                        _unimport(backout_module, batch)
                     del backout_module
+                yield from batch.steps()
+                batch = None
 
                 sys.modules.update(old_modules)
                 raise
 
         finally:
+            sys.meta_path.remove(precompiled_finder)
+            precompiled_finder = precompiled = None
+
             # Fix Python automatically shoving of children into parent packages
             for parent_package, name, value in parent_values:
                 if value == parent_package_deleted:
@@ -179,8 +665,17 @@ def reimport(*modules):
         now = time.time() - 1.0
         for name in new_names:
             _module_timestamps[name] = (now, True)
+            if name in digests:
+                _module_hashes[name] = digests[name]
+            else:
+                _module_hashes.pop(name, None)
+            _unindex_module(name)
+            _unindex_imports(name)
+
+        stats.modules.extend(new_names)
 
         # Push exported namespaces into parent packages
+        stats.start("push_symbols")
         push_symbols = {}
         for name in new_names:
             old_module = old_modules.get(name)
@@ -194,82 +689,1361 @@ def reimport(*modules):
                 new_module = sys.modules[name]
                 _push_imported_symbols(new_module, old_module, parent)
 
-        # Rejigger the universe
-        for name in new_names:
-            old = old_modules.get(name)
-            if not old:
-                continue
-            new = sys.modules[name]
-            rejigger = True
-            reimported = getattr(new, "__reimported__", None)
-            if reimported:
-                try:
-                    rejigger = reimported(old)
-                except Exception:
-                    # What else can we do? the callbacks must go on
-                    # Note, this is same as __del__ behaviour. /shrug
-                    traceback.print_exc()
-
-            if rejigger:
-                _rejigger_module(old, new, ignores)
-            else:
-                _unimport_module(new, ignores)
+        # Rejigger the universe. Swaps are collected for all modules
+        # and applied with a single walk of the heap
+        stats.start("rejigger")
+        batch = _SwapBatch(ignores, stats, scope, max_pause)
+        try:
+            for name in new_names:
+                old = old_modules.get(name)
+                if not old:
+                    continue
+                new = sys.modules[name]
+                rejigger = True
+                reimported = getattr(new, "__reimported__", None)
+                if reimported:
+                    try:
+                        rejigger = reimported(old)
+                    except Exception:
+                        # What else can we do? the callbacks must go on
+                        # Note, this is same as __del__ behaviour. /shrug
+                        traceback.print_exc()
+                        stats.count("callback_errors")
+
+                if rejigger:
+                    _rejigger_module(old, new, batch, skip_unchanged)
+                else:
+                    _unimport_module(new, batch)
+            old = new = None
+        finally:
+            stats.start("swap")
+            yield from batch.steps()
+            batch = None
 
     finally:
         if clear_type_cache:
             clear_type_cache()
+        _source_paths.clear()
 
-        # Restore the GIL
-        #gil_lock.release()
-        # sys.setswitchinterval(prev_interval)
-        time.sleep(0)
+        reload_barrier._release()
+        stats.start(None)
 
 
 
-def modified(path=None):
+def modified(path=None, content_hash=False):
     """Find loaded modules that have changed on disk under the given path.
         If no path is given then all modules are searched.
+
+        While a Watcher is started, this drains the modules it has seen
+        change instead of scanning the disk.
+        
+        With content_hash=True, a file with a new timestamp but the same
+        size is hashed and only reported if its contents differ from the
+        source last loaded. That source is known after a reimport, or
+        after a scan with content_hash that found the file unchanged.
         """
+    if _watcher is not None:
+        return _watcher.pending(path, content_hash=content_hash)
+    return _scan_modified(path, content_hash)
+
+
+
+async def modified_async(path=None, content_hash=False):
+    """Same as modified, run in the event loop's default executor so
+        the filesystem scan does not block the loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, modified, path, content_hash)
+
+
+
+def _scan_modified(path=None, content_hash=False):
+    """Poll timestamps of loaded source files under the given path"""
     global _previous_scan_time
     modules = []
     
     if path:
         path = os.path.normpath(path) + os.sep
-        
-    default_time = (_previous_scan_time, False)
-    pyc_ext = __debug__ and ".pyc" or ".pyo"
-    
-    for name, module in sys.modules.items():
-        filename = _is_code_module(module)
-        if not filename:
-            continue
 
-        filename = os.path.normpath(filename)
-        prev_time, prev_scan = _module_timestamps.setdefault(name, default_time)
-        if path and not filename.startswith(path):
+    with _index_lock:
+        _update_module_index()
+        default_time = (_previous_scan_time, False)
+
+        # One directory listing per watched directory, only indexed
+        # source files get their timestamp checked
+        for directory, files in _directory_index.items():
+            if path and not os.path.join(directory, "").startswith(path):
+                continue
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    names = files.get(entry.name)
+                    if not names:
+                        continue
+                    try:
+                        disk_stat = entry.stat()
+                    except OSError:
+                        continue
+                    disk_time = disk_stat.st_mtime
+                    for name in names:
+                        prev_time = _module_timestamps.get(name, default_time)[0]
+                        if prev_time < disk_time:
+                            if not content_hash or _content_changed(
+                                    name, entry.path, disk_stat):
+                                modules.append(name)
+                        elif content_hash and name not in _module_hashes:
+                            # Unchanged since loaded, remember what it held
+                            hashed = _hash_file(entry.path)
+                            if hashed is not None:
+                                _module_hashes[name] = hashed
+
+    _previous_scan_time = time.time()
+    return modules
+
+
+
+def _content_changed(name, filename, disk_stat):
+    """Second stage check for a module with a newer timestamp. Files of
+        the size last loaded are hashed and compared, if the contents
+        are the same the new timestamp becomes the baseline.
+        """
+    known = _module_hashes.get(name)
+    if known is None or known[0] != disk_stat.st_size:
+        return True
+    if _hash_file(filename) != known:
+        return True
+    _module_timestamps[name] = (disk_stat.st_mtime, True)
+    return False
+
+
+
+def _update_module_index():
+    """Bring the module index up to date with modules that entered or
+        left sys.modules since the last scan"""
+    with _index_lock:
+        loaded = dict(sys.modules)
+
+        for name in _module_index.keys() - loaded.keys():
+            _unindex_module(name)
+
+        default_time = (_previous_scan_time, False)
+
+        added = loaded.keys() - _module_index.keys()
+        if added:
+            _sorted_module_names.extend(added)
+            _sorted_module_names.sort()
+
+        for name in added:
+            filename = _is_code_module(loaded[name])
+            if not filename:
+                _module_index[name] = ""
+                continue
+
+            filename = os.path.normpath(filename)
+            _module_index[name] = filename
+            directory, basename = os.path.split(filename)
+            files = _directory_index.setdefault(directory or os.curdir, {})
+            files.setdefault(basename, []).append(name)
+
+            # Get timestamp of the loaded source if this is first time
+            # checking this module
+            prev_time, prev_scan = _module_timestamps.setdefault(name, default_time)
+            if not prev_scan:
+                loaded_time = _loaded_source_time(loaded[name], filename)
+                if loaded_time is not None:
+                    prev_time = loaded_time
+                _module_timestamps[name] = (prev_time, True)
+
+
+
+def _loaded_source_time(module, filename):
+    """Timestamp of the source a module was compiled from, as recorded in
+        the header of its __pycache__ file. None without a usable one."""
+    header = _bytecode_header(module, filename)
+    if header is None:
+        return None
+    source_time, source_size = header
+    try:
+        disk_stat = os.stat(filename)
+    except OSError:
+        return None
+
+    # The header only keeps whole seconds
+    if (int(disk_stat.st_mtime) & 0xFFFFFFFF == source_time and
+            disk_stat.st_size & 0xFFFFFFFF == source_size):
+        return disk_stat.st_mtime
+    return float(source_time)
+
+
+
+def _bytecode_header(module, filename):
+    """Source mtime and size from the timestamp based bytecode cached for
+        a module, trying the spec's cache and then every optimization
+        level. None if no cache matches this interpreter."""
+    candidates = []
+    spec = getattr(module, "__spec__", None)
+    cached = getattr(spec, "cached", None)
+    if cached:
+        candidates.append(cached)
+    for optimization in ("", 1, 2):
+        try:
+            candidates.append(importlib.util.cache_from_source(
+                                  filename, optimization=optimization))
+        except (NotImplementedError, ValueError):
+            break
+
+    for cached in candidates:
+        try:
+            with open(cached, "rb") as f:
+                data = f.read(16)
+        except (IOError, OSError):
             continue
+        if len(data) < 16 or data[:4] != importlib.util.MAGIC_NUMBER:
+            continue
+        flags, source_time, source_size = struct.unpack("<III", data[4:16])
+        if flags:
+            continue  # Hash based, no timestamp recorded
+        return source_time, source_size
+    return None
+
+
+
+def _unindex_module(name):
+    """Forget a module, it will be indexed again if still loaded"""
+    with _index_lock:
+        if name not in _module_index:
+            return
+        filename = _module_index.pop(name)
+        index = bisect.bisect_left(_sorted_module_names, name)
+        if index < len(_sorted_module_names) and _sorted_module_names[index] == name:
+            del _sorted_module_names[index]
+        if not filename:
+            return
+        directory, basename = os.path.split(filename)
+        directory = directory or os.curdir
+        files = _directory_index.get(directory, {})
+        names = files.get(basename, [])
+        if name in names:
+            names.remove(name)
+        if not names:
+            files.pop(basename, None)
+        if not files:
+            _directory_index.pop(directory, None)
+
+
+
+class Watcher(object):
+    """Watch the directories of loaded code modules for changes.
+        On Linux this uses inotify, so nothing is done while files are
+        idle and changes are queued as soon as they are saved. On other
+        platforms the watcher falls back to polling file timestamps.
+
+        Starting a watcher makes it the source for modified(). Use
+        pending() to drain the changed module names directly.
+        """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._inotify = None
+        self._wakeup = None
+        self._thread = None
+        self._watches = {}      # watch descriptor -> directory
+        self._directories = {}  # directory -> watch descriptor
+        self._dirty = set()     # (directory, basename) pairs
+        self._overflow = False
+        self._changed = threading.Condition()
+
+
+    def polling(self):
+        """True if changes are found by polling instead of events"""
+        return self._inotify is None
+
+
+    def start(self):
+        """Begin watching, and make this the watcher used by modified()"""
+        global _watcher
+        if _watcher is self:
+            return self
+        if _watcher is not None:
+            _watcher.stop()
 
-        # Get timestamp of .pyc if this is first time checking this module
-        if not prev_scan:
-            pyc_name = os.path.splitext(filename)[0] + pyc_ext
-            if pyc_name != filename:
+        try:
+            from ._inotify import Inotify
+            self._inotify = Inotify()
+        except (ImportError, OSError):
+            self._inotify = None
+        else:
+            self._wakeup = os.pipe()
+            self._thread = threading.Thread(target=self._read_events,
+                                            name="reimport-watcher")
+            self._thread.daemon = True
+            self._thread.start()
+
+        # Files changed before the watch began only show up in a scan,
+        # so the first pending() does a full one
+        with self._changed:
+            self._overflow = True
+        self._refresh()
+        _watcher = self
+        return self
+
+
+    def stop(self):
+        """Stop watching and release the inotify resources"""
+        global _watcher
+        if _watcher is self:
+            _watcher = None
+        if self._thread is not None:
+            os.write(self._wakeup[1], b"x")
+            self._thread.join()
+            self._thread = None
+        if self._wakeup is not None:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+        self._directories.clear()
+        self._dirty.clear()
+
+
+    def pending(self, path=None, timeout=0, content_hash=False):
+        """Drain names of modules that changed on disk under the given
+            path. If timeout is given, wait up to that many seconds for
+            a change to arrive. Content_hash works as for modified().
+            """
+        global _previous_scan_time
+        if self._inotify is None:
+            return self._poll(path, timeout, content_hash)
+
+        if path:
+            path = os.path.normpath(path) + os.sep
+
+        with self._changed:
+            if timeout and not self._dirty and not self._overflow:
+                self._changed.wait(timeout)
+            dirty, self._dirty = self._dirty, set()
+            overflow, self._overflow = self._overflow, False
+
+        if overflow:
+            # Events were lost, fall back to one full scan. Changes
+            # outside the path are queued for the calls that cover them.
+            self._refresh()
+            modules = []
+            skipped = set()
+            for name in _scan_modified(None, content_hash):
+                directory, basename = os.path.split(_module_index.get(name) or "")
+                directory = directory or os.curdir
+                if path and not os.path.join(directory, "").startswith(path):
+                    skipped.add((directory, basename))
+                else:
+                    modules.append(name)
+            if skipped:
+                with self._changed:
+                    self._dirty.update(skipped)
+            return modules
+
+        default_time = (_previous_scan_time, False)
+        modules = []
+        skipped = set()
+        for directory, basename in dirty:
+            if path and not os.path.join(directory, "").startswith(path):
+                skipped.add((directory, basename))
+                continue
+            with _index_lock:
+                names = list(_directory_index.get(directory, {}).get(basename, ()))
+            if not names:
+                continue
+            filename = os.path.join(directory, basename)
+            try:
+                disk_stat = os.stat(filename)
+            except OSError:
+                continue
+            for name in names:
+                if _module_timestamps.get(name, default_time)[0] >= disk_stat.st_mtime:
+                    continue
+                if not content_hash or _content_changed(name, filename, disk_stat):
+                    modules.append(name)
+
+        if skipped:
+            with self._changed:
+                self._dirty.update(skipped)
+
+        self._refresh()
+        _previous_scan_time = time.time()
+        return modules
+
+
+    def _poll(self, path, timeout, content_hash):
+        """Fallback for pending() when events are not available"""
+        deadline = time.time() + timeout
+        while True:
+            modules = _scan_modified(path, content_hash)
+            remaining = deadline - time.time()
+            if modules or remaining <= 0:
+                return modules
+            time.sleep(min(self.interval, remaining))
+
+
+    def _refresh(self):
+        """Watch directories of newly loaded modules"""
+        with _index_lock:
+            _update_module_index()
+            directories = set(_directory_index)
+        if self._inotify is None:
+            return
+        with self._changed:
+            for directory in list(self._directories):
+                if directory not in directories:
+                    self._inotify.rm_watch(self._directories.pop(directory))
+            for directory in directories:
+                if directory in self._directories:
+                    continue
+                try:
+                    wd = self._inotify.add_watch(directory)
+                except OSError:
+                    continue
+                self._watches[wd] = directory
+                self._directories[directory] = wd
+
+
+    def _read_events(self):
+        """Thread that queues changed files as events arrive"""
+        from ._inotify import IN_Q_OVERFLOW, IN_IGNORED
+        inotify = self._inotify
+        wakeup = self._wakeup[0]
+        while True:
+            ready = select.select([inotify, wakeup], [], [])[0]
+            if wakeup in ready:
+                return
+            events = inotify.read_events()
+            with self._changed:
+                for wd, mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        self._overflow = True
+                    elif mask & IN_IGNORED:
+                        directory = self._watches.pop(wd, None)
+                        self._directories.pop(directory, None)
+                    elif name and wd in self._watches:
+                        self._dirty.add((self._watches[wd], name))
+                self._changed.notify_all()
+
+
+
+class AutoReloader(object):
+    """Reimport changed modules from a background thread. Changes are
+        gathered from modified() until no new ones arrive for the
+        debounce period, then the whole batch goes to a single reimport.
+        
+        Paths limit which source directories are reloaded, by default
+        every module is a candidate. If a callback is given, it is
+        called after each batch with the list of module names, the
+        seconds the reimport took, and the exception if it failed.
+        Errors looking for changes are passed to it with no names, and
+        the reloader keeps going. Content_hash is passed on to modified(), so files that are
+        only touched are not reloaded.
+        """
+    def __init__(self, paths=None, debounce=0.2, interval=0.5, callback=None,
+                 content_hash=False):
+        self.paths = [os.path.normpath(p) + os.sep for p in paths or ()]
+        self.debounce = debounce
+        self.interval = interval
+        self.callback = callback
+        self.content_hash = content_hash
+        self._attempted = {}    # module name -> source mtime last reloaded
+        self._stopping = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        """Begin reloading in a daemon thread"""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="reimport-autoreloader")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+
+    def stop(self):
+        """Stop the reload thread, waiting for a running batch to end"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                names = self._collect(self.interval)
+                if not names:
+                    continue
+
+                # Keep gathering until the changes settle down
+                while not self._stopping.is_set():
+                    more = self._collect(self.debounce) - names
+                    if not more:
+                        break
+                    names.update(more)
+
+                if not self._stopping.is_set():
+                    self._reload(sorted(names))
+            except Exception as e:
+                # A failed scan must not end auto reloading
+                self._report([], 0.0, e)
+                self._stopping.wait(self.interval)
+
+
+    def _collect(self, timeout):
+        """Wait up to timeout and return the set of changed names"""
+        if _watcher is not None:
+            names = _watcher.pending(None, timeout, self.content_hash)
+        else:
+            self._stopping.wait(timeout)
+            names = modified(content_hash=self.content_hash)
+
+        changed = set()
+        for name in names:
+            filename = _module_index.get(name)
+            if not filename or name == "__main__":
+                continue
+            if self.paths and not [p for p in self.paths if filename.startswith(p)]:
+                continue
+            if name in self._attempted:
                 try:
-                    prev_time = os.path.getmtime(pyc_name)
+                    disk_time = os.path.getmtime(filename)
                 except OSError:
-                    pass
-            _module_timestamps[name] = (prev_time, True)
+                    continue
+                if disk_time == self._attempted[name]:
+                    continue
+                del self._attempted[name]
+            changed.add(name)
+        return changed
+
+
+    def _reload(self, names):
+        """Reimport one batch of names and report how it went"""
+        # Files only come back when they change again. This stops a
+        # failed reload from retrying, and the coarse loaded timestamps
+        # from reporting fresh edits twice.
+        for name in names:
+            try:
+                self._attempted[name] = os.path.getmtime(_module_index[name])
+            except (KeyError, OSError):
+                pass
 
-        # Get timestamp of source file
+        error = None
+        start = time.time()
         try:
-            disk_time = os.path.getmtime(filename)
-        except OSError:
-            disk_time = None
-                
-        if disk_time is not None and prev_time < disk_time:
+            reimport(*names)
+        except Exception as e:
+            error = e
+        self._report(names, time.time() - start, error)
+
+
+    def _report(self, names, elapsed, error):
+        """Pass how a batch went to the callback, or print the error"""
+        if self.callback is None:
+            if error is not None:
+                traceback.print_exception(type(error), error, error.__traceback__)
+            return
+        try:
+            self.callback(names, elapsed, error)
+        except Exception:
+            traceback.print_exc()
+
+
+
+class SharedState(object):
+    """A state file that lets one process scan source files for many.
+        The scanning process calls publish() to record the mtime, size
+        and hash of every source file in the directories of its loaded
+        modules. Other processes compare those records with what they
+        have loaded, without touching the source files themselves.
+
+        Starting a SharedState makes it the source for modified() in
+        that process, in place of scanning the disk.
+        """
+    def __init__(self, filename, interval=0.5):
+        from ._state import StateReader
+        self.filename = filename
+        self.interval = interval
+        self._reader = StateReader(filename)
+        self._published = {}    # filename -> (mtime, size, digest)
+
+
+    def publish(self):
+        """Scan the disk once and write the results for every reader"""
+        from ._state import write_state
+        with _index_lock:
+            _update_module_index()
+            directories = list(_directory_index)
+        records = {}
+        for directory in directories:
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if not entry.name.endswith(".py"):
+                        continue
+                    try:
+                        disk_stat = entry.stat()
+                    except OSError:
+                        continue
+                    record = self._published.get(entry.path)
+                    if record is None or record[:2] != (disk_stat.st_mtime,
+                                                        disk_stat.st_size):
+                        # Only hash files that changed since the last publish
+                        hashed = _hash_file(entry.path)
+                        digest = None
+                        if hashed is not None and hashed[0] == disk_stat.st_size:
+                            digest = hashed[1]
+                        record = (disk_stat.st_mtime, disk_stat.st_size, digest)
+                    records[entry.path] = record
+
+        self._reader.refresh()
+        write_state(self.filename, records, self._reader.generation + 1)
+        self._published = records
+
+
+    def start(self):
+        """Make this the source of changes used by modified()"""
+        global _watcher
+        if _watcher is not None and _watcher is not self:
+            _watcher.stop()
+        _watcher = self
+        return self
+
+
+    def stop(self):
+        global _watcher
+        if _watcher is self:
+            _watcher = None
+
+
+    def pending(self, path=None, timeout=0, content_hash=False):
+        """Names of loaded modules whose published source is newer than
+            the one loaded. If timeout is given, wait up to that many
+            seconds for a change to be published. Content_hash compares
+            the published hashes, as for modified().
+            """
+        deadline = time.time() + timeout
+        while True:
+            modules = self._changed(path, content_hash)
+            remaining = deadline - time.time()
+            if modules or remaining <= 0:
+                return modules
+            time.sleep(min(self.interval, remaining))
+
+
+    def _changed(self, path, content_hash):
+        global _previous_scan_time
+        if path:
+            path = os.path.normpath(path) + os.sep
+        self._reader.refresh()
+        records = self._reader.records
+        with _index_lock:
+            _update_module_index()
+            indexed = list(_module_index.items())
+        default_time = (_previous_scan_time, False)
+
+        modules = []
+        for name, filename in indexed:
+            record = records.get(filename) if filename else None
+            if record is None:
+                continue
+            if path and not filename.startswith(path):
+                continue
+            mtime, size, digest = record
+            known = _module_hashes.get(name)
+            if _module_timestamps.get(name, default_time)[0] >= mtime:
+                if content_hash and known is None and digest is not None:
+                    # Unchanged since loaded, remember what it held
+                    _module_hashes[name] = (size, digest)
+                continue
+            if content_hash and digest is not None and known == (size, digest):
+                _module_timestamps[name] = (mtime, True)
+                continue
             modules.append(name)
 
-    _previous_scan_time = time.time()
-    return modules
+        _previous_scan_time = time.time()
+        return sorted(modules)
+
+
+
+class FleetCoordinator(object):
+    """Finds changes once for many worker processes. Workers connect to
+        the Unix domain socket at address with a FleetWorker. Reload()
+        scans with modified(), compiles the changed sources to check
+        them, then sends the module names to every worker and collects
+        their reports.
+        
+        The coordinator does not reimport anything itself. Modules it
+        has sent out are not reported by its modified() again until
+        they change on disk once more. Workers that were not connected
+        for a reload, or failed to apply it, get the modules they
+        missed with the next reload.
+        """
+    def __init__(self, address, timeout=30.0):
+        self.address = address
+        self.timeout = timeout
+        self._server = None
+        self._workers = {}      # socket -> MessageReader
+        self._pids = {}         # socket -> worker process id
+        self._sequence = 0
+        self._sent = {}         # module name -> sequence it was last sent in
+        self._applied = {}      # worker process id -> last sequence applied
+
+
+    def start(self):
+        """Listen for workers"""
+        if self._server is None:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+            from ._fleet import listen
+            self._server = listen(self.address)
+        return self
+
+
+    def stop(self):
+        """Disconnect the workers and stop listening"""
+        for sock in list(self._workers):
+            self._drop(sock)
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+
+    def workers(self):
+        """Number of connected workers"""
+        self._accept()
+        return len(self._workers)
+
+
+    def reload(self, names=None, path=None, content_hash=False):
+        """Send changed modules to every worker. Names default to what
+            modified() finds under path. Compile errors are raised before
+            anything is sent. Returns a FleetReport.
+            """
+        from ._fleet import send_message
+        if names is None:
+            names = modified(path, content_hash)
+        report = FleetReport(sorted(names))
+
+        # Workers that missed earlier reloads get those modules as well.
+        # New workers are sent everything, they may have loaded early.
+        self._accept()
+        missed = {}
+        for sock in self._workers:
+            applied = self._applied.get(self._pids.get(sock), 0)
+            missed[sock] = [name for name, sequence in self._sent.items()
+                            if sequence > applied]
+        if not report.modules and not any(missed.values()):
+            return report
+
+        # Same check as the reimport precheck, once for all workers
+        _update_module_index()
+        checked = {}
+        for name in report.modules:
+            filename = _module_index.get(name)
+            if filename:
+                result = _precompile(os.path.splitext(filename)[0] + ".py")
+                if result is not None:
+                    checked[name] = result
+
+        self._sequence += 1
+        for name in report.modules:
+            self._sent[name] = self._sequence
+        waiting = []
+        for sock, names in missed.items():
+            names = sorted(set(names).union(report.modules))
+            if not names:
+                continue
+            try:
+                send_message(sock, {"id": self._sequence, "modules": names})
+                waiting.append(sock)
+            except OSError:
+                self._drop(sock)
+
+        deadline = time.time() + self.timeout
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            ready = select.select(waiting, [], [], remaining)[0]
+            for sock in ready:
+                try:
+                    messages = self._workers[sock].read()
+                except (EOFError, OSError):
+                    report.reports.append(self._missing(sock, "disconnected"))
+                    waiting.remove(sock)
+                    self._drop(sock)
+                    continue
+                for reply in messages:
+                    if "hello" in reply:
+                        self._pids[sock] = reply["hello"]
+                    elif reply.get("id") == self._sequence:
+                        report.reports.append(reply)
+                        waiting.remove(sock)
+                        if reply["ok"]:
+                            self._applied[reply["pid"]] = self._sequence
+        for sock in waiting:
+            report.reports.append(self._missing(sock, "no reply"))
+
+        # Sent out, or kept for workers that connect later, so this is
+        # the new baseline
+        for name, (file_stats, code, digest) in checked.items():
+            _module_timestamps[name] = (file_stats.st_mtime, True)
+            _module_hashes[name] = (file_stats.st_size, digest)
+        return report
+
+
+    def _accept(self):
+        """Take on workers waiting to connect, and read their hello"""
+        from ._fleet import MessageReader
+        if self._server is None:
+            return
+        while True:
+            try:
+                sock = self._server.accept()[0]
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(True)
+            reader = MessageReader(sock)
+            self._workers[sock] = reader
+
+            # Workers say hello as soon as they connect. The pid tells
+            # which reloads a reconnecting worker already applied.
+            try:
+                if select.select([sock], [], [], self.timeout)[0]:
+                    for message in reader.read():
+                        if "hello" in message:
+                            self._pids[sock] = message["hello"]
+            except (EOFError, OSError):
+                self._drop(sock)
+
+
+    def _drop(self, sock):
+        self._workers.pop(sock, None)
+        self._pids.pop(sock, None)
+        sock.close()
+
+
+    def _missing(self, sock, error):
+        return {"id": self._sequence, "pid": self._pids.get(sock), "ok": False,
+                "error": error, "modules": [], "elapsed": 0.0, "stats": None}
+
+
+
+class FleetReport(object):
+    """What the workers reported for one FleetCoordinator.reload. Each
+        report is a dict with the worker's pid, ok, the error if the
+        reimport failed and was rolled back, the modules it reimported,
+        the elapsed seconds and the ReimportStats as a dict.
+        """
+    def __init__(self, modules):
+        self.modules = modules
+        self.reports = []
+
+
+    def __repr__(self):
+        return "<FleetReport %d modules, %d workers, %d failed>" % (
+                    len(self.modules), len(self.reports), len(self.failed()))
+
+
+    def failed(self):
+        """Reports of the workers that did not apply the reimport"""
+        return [report for report in self.reports if not report["ok"]]
+
+
+
+class FleetWorker(object):
+    """Applies the reimports sent by a FleetCoordinator. A daemon thread
+        keeps connected to the coordinator, reconnecting every interval
+        seconds when it is not there. Modules this process has not
+        loaded are left out. If a callback is given it is called with
+        the module names, the ReimportStats and the error after each.
+        """
+    def __init__(self, address, interval=1.0, callback=None):
+        self.address = address
+        self.interval = interval
+        self.callback = callback
+        self._stopping = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="reimport-fleet-worker")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+
+    def _run(self):
+        from ._fleet import send_message, MessageReader, connect
+        while not self._stopping.is_set():
+            try:
+                sock = connect(self.address)
+            except OSError:
+                self._stopping.wait(self.interval)
+                continue
+
+            reader = MessageReader(sock)
+            try:
+                send_message(sock, {"hello": os.getpid()})
+                while not self._stopping.is_set():
+                    if not select.select([sock], [], [], self.interval)[0]:
+                        continue
+                    for message in reader.read():
+                        send_message(sock, self._apply(message))
+            except (EOFError, OSError):
+                pass
+            finally:
+                sock.close()
+
+
+    def _apply(self, message):
+        """Reimport the modules of one message, and report how it went"""
+        names = [name for name in message["modules"] if name in sys.modules]
+        stats = error = None
+        start = time.time()
+        try:
+            if names:
+                stats = reimport(*names)
+        except Exception as e:
+            # reimport has rolled back what it imported
+            error = "%s: %s" % (type(e).__name__, e)
+        elapsed = time.time() - start
+
+        if self.callback is not None:
+            try:
+                self.callback(names, stats, error)
+            except Exception:
+                traceback.print_exc()
+
+        return {"id": message["id"], "pid": os.getpid(), "ok": error is None,
+                "error": error, "modules": names, "elapsed": elapsed,
+                "stats": stats.as_dict() if stats is not None else None}
+
+
+
+def _precompile(pyname, marshalled=False):
+    """Read and compile a source file the same way the import system
+        does. Returns (stats, code, digest), or None if it cannot be read.
+        The code is marshalled when it has to cross a process boundary.
+        """
+    try:
+        with open(pyname, "rb") as source:
+            stats = os.fstat(source.fileno())
+            data = source.read()
+    except (IOError, OSError):
+        return None
+
+    # Same flags as the import system, let this raise exceptions
+    code = compile(data, pyname, "exec", dont_inherit=True)
+    if marshalled:
+        code = marshal.dumps(code)
+    return stats, code, _source_hash(data).digest()
+
+
+
+def _source_hash(data=b""):
+    """The hash used to tell if a source file really changed"""
+    return hashlib.blake2b(data, digest_size=16)
+
+
+
+def _hash_file(filename):
+    """Size and hash of a file, read in chunks. None if it cannot be read"""
+    digest = _source_hash()
+    size = 0
+    try:
+        with open(filename, "rb") as source:
+            while True:
+                chunk = source.read(_hash_chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return size, digest.digest()
+
+
+
+class ReimportStats(object):
+    """Timing and counters from one reimport call. Phases maps each
+        phase name to the wall clock seconds spent in it, in the order
+        they ran. Counts holds the number of modules, classes and
+        functions rejiggered, the objects swapped and removed, the
+        referrers visited and the containers patched by type.
+        """
+    def __init__(self):
+        self.modules = []
+        self.phases = {}
+        self.counts = {}
+        self.canary = None
+        self._phase = None
+        self._started = 0.0
+
+
+    def __repr__(self):
+        return "<ReimportStats %d modules in %.3fs>" % (len(self.modules),
+                                                       self.total())
+
+
+    def total(self):
+        """Seconds spent in all phases"""
+        return sum(self.phases.values())
+
+
+    def start(self, phase):
+        """End the running phase and start timing the next one"""
+        now = time.perf_counter()
+        if self._phase is not None:
+            elapsed = now - self._started
+            self.phases[self._phase] = self.phases.get(self._phase, 0.0) + elapsed
+        self._phase = phase
+        self._started = now
+
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+    def as_dict(self):
+        """Plain data version, suitable for json"""
+        return {"modules": list(self.modules), "total": self.total(),
+                "phases": dict(self.phases), "counts": dict(self.counts),
+                "canary": self.canary}
+
+
+
+class ReimportCanaryError(Exception):
+    """Raised by reimport(canary=True) when the trial reimport in the
+        forked child failed, before this process was changed. Stats is
+        the child's ReimportStats as a dict, if it got that far.
+        """
+    def __init__(self, error, stats=None):
+        Exception.__init__(self, error)
+        self.error = error
+        self.stats = stats
+
+
+
+class ReimportPlan(object):
+    """What a reimport would do, as worked out by plan_reimport. Changed,
+        unchanged, added and removed list the dotted names of functions
+        and classes. Errors maps each module that fails to compile to its
+        error. Referrers counts the containers that refer to each module,
+        function and class that would be swapped or removed. Pause is the
+        seconds the swap phase's search for referrers took, plus one pass
+        over them in place of patching.
+        """
+    def __init__(self):
+        self.modules = []
+        self.changed = []
+        self.unchanged = []
+        self.added = []
+        self.removed = []
+        self.errors = {}
+        self.referrers = {}
+        self.pause = 0.0
+
+
+    def __repr__(self):
+        return "<ReimportPlan %d modules, %d changed, %d removed, %.3fs pause>" % (
+                    len(self.modules), len(self.changed), len(self.removed),
+                    self.pause)
+
+
+    def as_dict(self):
+        """Plain data version, suitable for json"""
+        return {"modules": list(self.modules), "changed": list(self.changed),
+                "unchanged": list(self.unchanged), "added": list(self.added),
+                "removed": list(self.removed), "errors": dict(self.errors),
+                "referrers": dict(self.referrers), "pause": self.pause}
+
+
+
+class ReimportScope(object):
+    """Limits where references to swapped objects are searched for.
+        Roots are containers or objects walked through lists, tuples,
+        dicts, sets and instances. Modules, classes and functions reached
+        from them are searched but not walked into. A generation also
+        searches every object in that garbage collector generation or
+        a younger one, which needs Python 3.8. Without either, nothing
+        is searched.
+        """
+    def __init__(self, roots=(), generation=None):
+        if generation is not None and sys.version_info < (3, 8):
+            raise ValueError("ReimportScope generation needs Python 3.8 or "
+                             "newer, gc.get_objects takes no generation")
+        self.roots = list(roots)
+        self.generation = generation
+
+
+    def __repr__(self):
+        return "<ReimportScope %d roots, generation %r>" % (len(self.roots),
+                                                            self.generation)
+
+
+    def objects(self):
+        """Every object that is searched, as a list"""
+        found = {}
+        if self.generation is not None:
+            for generation in range(self.generation + 1):
+                for obj in gc.get_objects(generation):
+                    found[id(obj)] = obj
+
+        walked = set()
+        pending = list(self.roots)
+        for root in pending:
+            found[id(root)] = root
+            walked.add(id(root))
+        while pending:
+            for obj in gc.get_referents(pending.pop()):
+                if id(obj) in walked or not gc.is_tracked(obj):
+                    continue
+                walked.add(id(obj))
+                found[id(obj)] = obj
+                if not _scope_leaf(obj):
+                    pending.append(obj)
+        return list(found.values())
+
+
+
+def track_instances(cls):
+    """Class decorator that keeps a weak set of the instances of a class
+        and its subclasses. Reimport moves them to the new class straight
+        from that set, instead of finding them in the heap.
+        """
+    if not cls.__weakrefoffset__:
+        raise TypeError("Instances of %r cannot be weakly referenced" % cls)
+    base_new = cls.__new__
+
+    def __new__(klass, *args, **kwargs):
+        if base_new is object.__new__:
+            instance = base_new(klass)
+        else:
+            instance = base_new(klass, *args, **kwargs)
+        instances = klass.__dict__.get("__reimport_instances__")
+        if instances is None:
+            instances = klass.__reimport_instances__ = weakref.WeakSet()
+        instances.add(instance)
+        return instance
+
+    cls.__new__ = staticmethod(__new__)
+    cls.__reimport_instances__ = weakref.WeakSet()
+    return cls
+
+
+
+class ReloadBarrier(object):
+    """Keeps threads from running while reimport changes modules. Use
+        the barrier as a context manager around work that must not see
+        a half reimported module, like handling a request. Entering it
+        waits for a running reimport, and reimport waits for threads
+        inside it to leave.
+        """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._inside = 0
+        self._owner = None
+        self._depth = 0
+
+
+    def __enter__(self):
+        with self._condition:
+            while self._depth and self._owner != threading.get_ident():
+                self._condition.wait()
+            self._inside += 1
+            self._local.inside = getattr(self._local, "inside", 0) + 1
+        return self
+
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._inside -= 1
+            self._local.inside -= 1
+            self._condition.notify_all()
+
+
+    @property
+    def reloading(self):
+        """True while a reimport is changing modules"""
+        return bool(self._depth)
+
+
+    def wait(self, timeout=None):
+        """Wait for a running reimport to finish, without entering.
+            Returns False if the timeout ran out first."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._depth or self._owner == threading.get_ident(),
+                timeout)
+
+
+    def _acquire(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return
+
+            # A thread waiting here is not running code inside the
+            # barrier, so its own entries must not hold off a reimport
+            # another thread has started
+            mine = getattr(self._local, "inside", 0)
+            self._inside -= mine
+            if mine:
+                self._condition.notify_all()
+            try:
+                while self._depth:
+                    self._condition.wait()
+                # Hold off newcomers, then wait for the others to leave
+                self._owner = me
+                self._depth = 1
+                while self._inside:
+                    self._condition.wait()
+            finally:
+                self._inside += mine
+
+
+    def _release(self):
+        with self._condition:
+            self._depth -= 1
+            if not self._depth:
+                self._owner = None
+                self._condition.notify_all()
+
+
+    def _after_fork(self):
+        """Only the forking thread lives on in a child process"""
+        self._condition = threading.Condition(threading.Lock())
+        self._inside = getattr(self._local, "inside", 0)
+        if self._owner != threading.get_ident():
+            self._owner = None
+            self._depth = 0
+
+
+reload_barrier = ReloadBarrier()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reload_barrier._after_fork)
+
+
+
+def _scope_leaf(obj):
+    """Objects a ReimportScope does not walk into. Their references lead
+        to module globals, and from there to most of the heap."""
+    return (inspect.ismodule(obj) or inspect.isclass(obj) or
+            inspect.isfunction(obj) or inspect.iscode(obj) or
+            inspect.isframe(obj))
+
+
+
+class _PrecompiledFinder(object):
+    """Meta path finder that hands code compiled by the reimport
+        SyntaxError check to the import of that same source file.
+        """
+    def __init__(self, precompiled, write_bytecode):
+        self.precompiled = precompiled
+        self.write_bytecode = write_bytecode
+
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.precompiled:
+            return None
+
+        # Let the regular finders locate the module
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        filename, stats, code, digest = self.precompiled.pop(fullname)
+        if type(spec.loader) is not importlib.machinery.SourceFileLoader:
+            return spec
+        if os.path.normcase(spec.origin) != os.path.normcase(filename):
+            return spec
+        spec.loader = _PrecompiledLoader(fullname, spec.origin, code,
+                                         stats, self.write_bytecode)
+        return spec
+
+
+
+class _PrecompiledLoader(importlib.machinery.SourceFileLoader):
+    """Source loader that executes an already compiled code object"""
+    def __init__(self, fullname, path, code, stats, write_bytecode):
+        super().__init__(fullname, path)
+        self._code = code
+        self._stats = stats
+        self._write_bytecode = write_bytecode
+
+
+    def get_code(self, fullname):
+        code, self._code = self._code, None
+        if code is None:
+            return super().get_code(fullname)
+        if self._write_bytecode and not sys.dont_write_bytecode:
+            self._cache_code(code)
+        return code
+
+
+    def exec_module(self, module):
+        try:
+            super().exec_module(module)
+        finally:
+            # Leave a standard loader behind for inspect and later imports
+            loader = importlib.machinery.SourceFileLoader(self.name, self.path)
+            module.__loader__ = loader
+            if getattr(module, "__spec__", None) is not None:
+                module.__spec__.loader = loader
+
+
+    def _cache_code(self, code):
+        """Write code as a timestamp based __pycache__ file"""
+        try:
+            bytecode_path = importlib.util.cache_from_source(self.path)
+        except NotImplementedError:
+            return
+        data = bytearray(importlib.util.MAGIC_NUMBER)
+        data.extend(struct.pack("<III", 0,
+                                int(self._stats.st_mtime) & 0xFFFFFFFF,
+                                self._stats.st_size & 0xFFFFFFFF))
+        data.extend(marshal.dumps(code))
+        self.set_data(bytecode_path, bytes(data))
+
 
 
 def _safevars(obj):
@@ -289,22 +2063,35 @@ def _is_code_module(module):
 
 
 
-def _find_exact_target(module):
+def _indexed_source(name, module):
+    """Like _is_code_module, using the module index when it knows the name"""
+    filename = _module_index.get(name)
+    if filename is None:
+        filename = _is_code_module(module)
+    return filename
+
+
+
+def _find_exact_target(module, package_flags=None):
     """Given a module name or object, find the
-            base module where reimport will happen."""
+            base module where reimport will happen.
+            Package_flags memoizes the package_reimport magic of
+            parent packages across calls for one reimport."""
     # Given a name or a module, find both the name and the module
-    actual_module = sys.modules.get(module)
-    if actual_module is not None:
+    if isinstance(module, str):
+        actual_module = sys.modules.get(module)
+        if actual_module is None:
+            return "", None
         name = module
     else:
-        for name, mod in sys.modules.items():
-            if mod is module:
-                actual_module = module
-                break
-        else:
+        name = _find_module_name(module)
+        if name is None:
             return "", None
+        actual_module = module
 
     # Find highest level parent package that has package_reimport magic
+    if package_flags is None:
+        package_flags = {}
     parent_name = name
     while True:
         split_name = parent_name.rsplit(".", 1)
@@ -312,20 +2099,48 @@ def _find_exact_target(module):
             return name, actual_module
         parent_name = split_name[0]
         
-        parent_module = sys.modules.get(parent_name)
-        if getattr(parent_module, "__package_reimport__", None):
+        flag = package_flags.get(parent_name)
+        if flag is None:
+            parent_module = sys.modules.get(parent_name)
+            flag = bool(getattr(parent_module, "__package_reimport__", None))
+            package_flags[parent_name] = flag
+        if flag:
             name = parent_name
-            actual_module = parent_module
+            actual_module = sys.modules[parent_name]
+
+
+
+def _find_module_name(module):
+    """Find the name a module object is loaded as in sys.modules"""
+    global _module_names
+
+    # Modules nearly always know their own name
+    spec = getattr(module, "__spec__", None)
+    for name in (getattr(spec, "name", None), getattr(module, "__name__", None)):
+        if isinstance(name, str) and sys.modules.get(name) is module:
+            return name
+
+    # Otherwise use the identity index, rebuilt when it is out of date
+    name = _module_names.get(id(module))
+    if name is None or sys.modules.get(name) is not module:
+        _module_names = dict((id(m), n) for n, m in list(sys.modules.items()))
+        name = _module_names.get(id(module))
+        if name is None or sys.modules.get(name) is not module:
+            return None
+    return name
 
 
 
 def _find_reloading_modules(name):
-    """Find all modules that will be reloaded from given name"""
+    """Find all modules that will be reloaded from given name. This
+        expects the module index to be up to date."""
     modules = [name]
-    child_names = name + "."
-    for name in sys.modules.keys():
-        if name.startswith(child_names) and _is_code_module(sys.modules[name]):
-            modules.append(name)
+    # Children sort between "name." and "name/", the next character
+    start = bisect.bisect_left(_sorted_module_names, name + ".")
+    end = bisect.bisect_left(_sorted_module_names, name + "/", start)
+    for child in _sorted_module_names[start:end]:
+        if _module_index[child]:
+            modules.append(child)
     return modules
 
 
@@ -338,6 +2153,103 @@ def _package_depth_sort(names, reverse):
 
 
 
+def _update_import_graph():
+    """Scan modules that entered sys.modules since the last update and
+        forget the ones that left"""
+    loaded = dict(sys.modules)
+    for name in _module_imports.keys() - loaded.keys():
+        _unindex_imports(name)
+    for name in loaded.keys() - _module_imports.keys():
+        _index_imports(name, loaded[name])
+
+
+
+def _index_imports(name, module):
+    """Record which modules a module imports, judged by the modules,
+        classes and functions found in its globals"""
+    imports = set()
+    if _indexed_source(name, module):
+        for value in list(_safevars(module).values()):
+            if isinstance(value, _ModuleType):
+                imported = getattr(value, "__name__", None)
+            elif inspect.isclass(value) or inspect.isfunction(value):
+                imported = getattr(value, "__module__", None)
+            else:
+                continue
+            if isinstance(imported, str) and imported != name:
+                imports.add(imported)
+
+    _module_imports[name] = imports
+    for imported in imports:
+        _module_importers.setdefault(imported, set()).add(name)
+
+
+
+def _unindex_imports(name):
+    """Forget what a module imports, it is scanned again if still loaded"""
+    for imported in _module_imports.pop(name, ()):
+        importers = _module_importers.get(imported)
+        if importers is not None:
+            importers.discard(name)
+            if not importers:
+                del _module_importers[imported]
+
+
+
+def _add_dependent_modules(reload_set, package_flags=None):
+    """Add all loaded modules that depend on the reloading modules"""
+    _update_import_graph()
+    pending = list(reload_set)
+    while pending:
+        for importer in _module_importers.get(pending.pop(), ()):
+            if importer in reload_set or importer == "__main__":
+                continue
+            name, target = _find_exact_target(importer, package_flags)
+            if not target or not _indexed_source(name, target):
+                continue
+            for name in _find_reloading_modules(name):
+                if name not in reload_set:
+                    reload_set.add(name)
+                    pending.append(name)
+
+
+
+def _dependency_sort(names):
+    """Sort module names so modules come after the modules they import.
+        Ties, and modules in import cycles, go by package depth."""
+    def packageOrder(name):
+        return name.count("."), name
+
+    names = set(names)
+    depends = {}
+    importers = dict((name, []) for name in names)
+    for name in names:
+        depends[name] = (_module_imports.get(name, set()) & names) - set([name])
+        for imported in depends[name]:
+            importers[imported].append(name)
+
+    ready = [(packageOrder(n), n) for n, deps in depends.items() if not deps]
+    heapq.heapify(ready)
+    ordered = []
+    while depends:
+        if not ready:
+            # Import cycle, break it at the shallowest module
+            name = min(depends, key=packageOrder)
+            ready.append((packageOrder(name), name))
+        name = heapq.heappop(ready)[1]
+        if depends.pop(name, None) is None:
+            continue
+        ordered.append(name)
+        for importer in importers[name]:
+            deps = depends.get(importer)
+            if deps and name in deps:
+                deps.discard(name)
+                if not deps:
+                    heapq.heappush(ready, (packageOrder(importer), importer))
+    return ordered
+
+
+
 def _find_module_exports(module):
     all_names = getattr(module, "__all__", ())
     if not all_names:
@@ -409,12 +2321,13 @@ def _push_imported_symbols(new_module, old_module, parent):
 # and then to swap external references from old to new
 
 
-def _rejigger_module(old, new, ignores):
+def _rejigger_module(old, new, batch, skip_unchanged=False):
     """Mighty morphin power modules"""
     __internal_swaprefs_ignore__ = "rejigger_module"
     old_vars = _safevars(old)
     new_vars = _safevars(new)
-    ignores += (id(old_vars),)
+    batch.ignore(old_vars)
+    batch.stats.count("modules")
     old.__doc__ = new.__doc__
 
     # Get filename used by python code
@@ -427,46 +2340,286 @@ def _rejigger_module(old, new, ignores):
                 continue
 
             if _from_file(filename, value):
-                if inspect.isclass(value):
+                if skip_unchanged and _same_fingerprint(old_value, value):
+                    batch.stats.count("unchanged")
+                    if _uses_globals(old_value):
+                        _swap_unchanged(old_value, value, batch)
+                    else:
+                        # Works the same from either namespace
+                        _keep_unchanged(old_value, value, batch)
+                        setattr(new, name, old_value)
+                        continue
+
+                elif inspect.isclass(value):
                     if inspect.isclass(old_value):
-                        _rejigger_class(old_value, value, ignores)
+                        _rejigger_class(old_value, value, batch)
                     
                 elif inspect.isfunction(value):
                     if inspect.isfunction(old_value):
-                        _rejigger_func(old_value, value, ignores)
+                        _rejigger_func(old_value, value, batch)
         
         setattr(old, name, value)
 
-    for name, value in old_vars.items():
+    for name, value in list(old_vars.items()):
         if name not in new_vars:
             delattr(old, name)
             if _from_file(filename, value):
                 if inspect.isclass(value) or inspect.isfunction(value):
-                    _remove_refs(value, ignores)
+                    batch.remove(value)
     
-    _swap_refs(old, new, ignores)
+    batch.swap(old, new)
+
+
+
+def _swap_unchanged(old, new, batch):
+    """Move references from an unchanged function or class, and from the
+        methods and nested classes of a class, to the new versions. The
+        old objects are not patched in place, they behave the same."""
+    if inspect.isclass(old):
+        old_vars = _safevars(old)
+        instances = old_vars.get("__reimport_instances__")
+        if instances is not None:
+            _migrate_instances(instances, old, new, batch)
+        for name, value in _safevars(new).items():
+            old_value = old_vars.get(name)
+            if old_value is None or old_value is value:
+                continue
+            if inspect.isclass(value) and value.__module__ == new.__module__:
+                _swap_unchanged(old_value, value, batch)
+            elif inspect.isfunction(value) and inspect.isfunction(old_value):
+                batch.swap(old_value, value)
+    batch.swap(old, new)
 
 
 
-def _from_file(filename, value):
-    """Test if object came from a filename, works for pyc/py confusion"""
+def _keep_unchanged(old, new, batch):
+    """Move references from the new copy of an unchanged function or
+        class, and from its nested classes, back to the old one. Only
+        objects the new module created refer to the copy. The old
+        functions take the new code, which only differs in line numbers.
+        """
+    if inspect.isfunction(old):
+        old.__code__ = new.__code__
+    else:
+        new_vars = _safevars(new)
+        instances = new_vars.get("__reimport_instances__")
+        if instances is not None:
+            _migrate_instances(instances, new, old, batch)
+        old_vars = _safevars(old)
+        for name, value in new_vars.items():
+            old_value = old_vars.get(name)
+            if old_value is None or old_value is value:
+                continue
+            if inspect.isclass(value) and value.__module__ == new.__module__:
+                _keep_unchanged(old_value, value, batch)
+                continue
+            if isinstance(value, (staticmethod, classmethod)):
+                pairs = [(getattr(old_value, "__func__", None), value.__func__)]
+            elif isinstance(value, property):
+                pairs = [(getattr(old_value, attr, None), getattr(value, attr))
+                         for attr in ("fget", "fset", "fdel")]
+            else:
+                pairs = [(old_value, value)]
+            for old_func, new_func in pairs:
+                if inspect.isfunction(old_func) and inspect.isfunction(new_func):
+                    old_func.__code__ = new_func.__code__
+    batch.swap(new, old)
+
+
+
+def _uses_globals(value, seen=None):
+    """Test if a function, or anything defined in a class, can read or
+        write module globals. Builtins are looked up the same way."""
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return False
+    seen.add(id(value))
+
+    if inspect.isfunction(value):
+        if _code_uses_globals(value.__code__):
+            return True
+        # Wrapped functions and other callables it holds on to
+        members = list(value.__defaults__ or ())
+        for cell in value.__closure__ or ():
+            try:
+                members.append(cell.cell_contents)
+            except ValueError:
+                pass  # Empty cell
+    elif inspect.isclass(value):
+        members = []
+        for member in vars(value).values():
+            if isinstance(member, (staticmethod, classmethod)):
+                members.append(member.__func__)
+            elif isinstance(member, property):
+                members.extend((member.fget, member.fset, member.fdel))
+            elif not inspect.isclass(member) or member.__module__ == value.__module__:
+                members.append(member)
+    else:
+        return False
+
+    for member in members:
+        if inspect.isfunction(member) and _uses_globals(member, seen):
+            return True
+        if (inspect.isclass(member) and inspect.isclass(value) and
+                _uses_globals(member, seen)):
+            return True
+    return False
+
+
+
+def _code_uses_globals(code):
+    """Test if a code object, or code nested in it, touches globals"""
+    for instruction in dis.get_instructions(code):
+        if instruction.opname in _global_opnames:
+            return True
+    for const in code.co_consts:
+        if inspect.iscode(const) and _code_uses_globals(const):
+            return True
+    return False
+
+
+
+def _same_fingerprint(old, new):
+    """Test if two functions, or two classes, are built the same"""
+    if inspect.isfunction(old) and inspect.isfunction(new):
+        pass
+    elif not (inspect.isclass(old) and inspect.isclass(new)):
+        return False
     try:
-        objfile = inspect.getsourcefile(value)
-    except TypeError:
+        return bool(_fingerprint(old) == _fingerprint(new))
+    except Exception:
+        # Values with an unusual __eq__, count them as changed
         return False
-    return bool(objfile) and objfile.startswith(filename)
 
 
 
-def _rejigger_class(old, new, ignores):
+def _fingerprint(value):
+    """Structure of a function, class or member value that does not depend
+        on line numbers or on which load of a module created it. Functions
+        and classes are compared through their code and members, other
+        values by equality."""
+    if inspect.isfunction(value):
+        closure = value.__closure__ or ()
+        cells = []
+        for cell in closure:
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                contents = _unknown  # Empty cell
+            if inspect.isclass(contents):
+                # Most likely the __class__ cell, do not recurse into it
+                cells.append(("class", contents.__module__, contents.__qualname__))
+            else:
+                cells.append(_fingerprint(contents))
+        return ("function", _code_fingerprint(value.__code__),
+                _fingerprint(value.__defaults__),
+                _fingerprint(value.__kwdefaults__), tuple(cells),
+                tuple(sorted(value.__dict__)),
+                tuple(sorted(getattr(value, "__annotations__", None) or ())))
+
+    if inspect.isclass(value):
+        members = []
+        for name, member in sorted(vars(value).items()):
+            if name in _class_internals and name != "__doc__":
+                continue
+            if inspect.ismemberdescriptor(member) or inspect.isgetsetdescriptor(member):
+                members.append((name, "slot"))
+            else:
+                members.append((name, _fingerprint(member)))
+        return ("class", value.__name__, type(value).__name__,
+                tuple((b.__module__, b.__qualname__) for b in value.__bases__),
+                tuple(members))
+
+    if isinstance(value, (staticmethod, classmethod)):
+        return (type(value).__name__, _fingerprint(value.__func__))
+    if isinstance(value, property):
+        return ("property", _fingerprint(value.fget), _fingerprint(value.fset),
+                _fingerprint(value.fdel), value.__doc__)
+    if isinstance(value, tuple):
+        return ("tuple",) + tuple(_fingerprint(item) for item in value)
+    if isinstance(value, dict):
+        return ("dict", tuple((key, _fingerprint(item))
+                              for key, item in value.items()))
+    if isinstance(value, _ModuleType):
+        return ("module", value.__name__)
+    return (type(value), value)
+
+
+
+def _code_fingerprint(code):
+    """Structure of a code object without its line numbers and filename"""
+    consts = []
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            consts.append(_code_fingerprint(const))
+        else:
+            consts.append(marshal.dumps(const))
+    return (code.co_name, code.co_code, tuple(consts), code.co_names,
+            code.co_varnames, code.co_freevars, code.co_cellvars,
+            code.co_argcount, getattr(code, "co_posonlyargcount", 0),
+            code.co_kwonlyargcount, code.co_flags,
+            getattr(code, "co_exceptiontable", b""))
+
+
+
+def _from_file(filename, value):
+    """Test if object came from a filename, works for pyc/py confusion"""
+    objfile = _source_file(value)
+    return bool(objfile) and objfile == _source_path(filename)
+
+
+
+def _source_file(value):
+    """Find the source file a module, class or function comes from, or
+        "" for anything else. Functions use their code's co_filename and
+        classes the file of their __module__, so the filesystem is never
+        touched."""
+    if inspect.isfunction(value):
+        filename = value.__code__.co_filename
+    elif inspect.isclass(value):
+        module = sys.modules.get(getattr(value, "__module__", None) or "")
+        filename = getattr(module, "__file__", None)
+    elif isinstance(value, _ModuleType):
+        filename = getattr(value, "__file__", None)
+    else:
+        return ""
+    if not isinstance(filename, str):
+        return ""
+    return _source_path(filename)
+
+
+
+def _source_path(filename):
+    """Normalize a filename to compare source files, memoized for the
+        duration of a reimport"""
+    path = _source_paths.get(filename)
+    if path is None:
+        base, ext = os.path.splitext(filename)
+        if ext in (".pyc", ".pyo"):
+            path = base + ".py"
+        else:
+            path = filename
+        path = _source_paths[filename] = os.path.normcase(os.path.normpath(path))
+    return path
+
+
+
+def _rejigger_class(old, new, batch):
     """Mighty morphin power classes"""
     __internal_swaprefs_ignore__ = "rejigger_class"    
     old_vars = _safevars(old)
     new_vars = _safevars(new)
-    ignores += (id(old_vars),)    
+    batch.ignore(old_vars)
+    batch.stats.count("classes")
+
+    instances = old_vars.get("__reimport_instances__")
+    if instances is not None:
+        _migrate_instances(instances, old, new, batch)
 
     slotted = hasattr(old, "__slots__") and isinstance(old.__slots__, tuple)
-    ignore_attrs = ["__dict__", "__doc__", "__weakref__"]
+    ignore_attrs = ["__dict__", "__doc__", "__weakref__",
+                    "__reimport_instances__"]
     if slotted:
         ignore_attrs.extend(old.__slots__)
         ignore_attrs.append("__slots__")
@@ -482,88 +2635,112 @@ def _rejigger_class(old, new, ignores):
                 continue
 
             if inspect.isclass(value) and value.__module__ == new.__module__:
-                _rejigger_class(old_value, value, ignores)
+                _rejigger_class(old_value, value, batch)
             
             elif inspect.isfunction(value):
-                _rejigger_func(old_value, value, ignores)
+                _rejigger_func(old_value, value, batch)
 
         setattr(old, name, value)
     
-    for name, value in old_vars.items():
+    for name, value in list(old_vars.items()):
         if name not in new_vars:
             delattr(old, name)
-            _remove_refs(value, ignores)
+            batch.remove(value)
 
-    _swap_refs(old, new, ignores)
+    batch.swap(old, new)
+
+
+
+def _migrate_instances(instances, old, new, batch):
+    """Move the tracked instances of a class over to its new version,
+        a chunk at a time. The set is emptied, so instances created by
+        other threads in between are moved as well.
+        """
+    tracked = new.__dict__.get("__reimport_instances__")
+    while instances:
+        chunk = []
+        for _ in range(min(len(instances), _instance_chunk_size)):
+            try:
+                chunk.append(instances.pop())
+            except KeyError:
+                break  # The rest were dead references
+        for instance in chunk:
+            if type(instance) is not old:
+                continue
+            try:
+                instance.__class__ = new
+            except TypeError:
+                # Type error happens on slotted classes
+                continue
+            if tracked is not None:
+                tracked.add(instance)
+            batch.stats.count("patched_instance")
+        chunk = instance = None
+        time.sleep(0)
 
 
 
-def _rejigger_func(old, new, ignores):
+def _rejigger_func(old, new, batch):
     """Mighty morphin power functions"""
     __internal_swaprefs_ignore__ = "rejigger_func"    
+    batch.stats.count("functions")
     old.__code__ = new.__code__
     old.__doc__ = new.__doc__
     old.__defaults__ = new.__defaults__
     old.__dict__ = new.__dict__
-    _swap_refs(old, new, ignores)
+    batch.swap(old, new)
 
 
 
-def _unimport(old, ignores):
+def _unimport(old, batch):
     """Unimport something, mainly used to rollback a reimport"""
     if isinstance(old, type(sys)):
-        _unimport_module(old, ignores)
+        _unimport_module(old, batch)
     elif inspect.isclass(old):
-        _unimport_class(old, ignores)
+        _unimport_class(old, batch)
     else:
-        _remove_refs(old, ignores)
+        batch.remove(old)
     
 
 
-def _unimport_module(old, ignores):
+def _unimport_module(old, batch):
     """Remove traces of a module"""
     __internal_swaprefs_ignore__ = "unimport_module"
     old_values = _safevars(old).values()
-    ignores += (id(old_values),)    
+    batch.ignore(old_values)
 
     # Get filename used by python code
-    filename = old.__file__
-    fileext = os.path.splitext(filename)
-    if fileext in (".pyo", ".pyc", ".pyw"):
-        filename = filename[:-1]
+    filename = _source_file(old)
 
     for value in old_values:
-        try: objfile = inspect.getsourcefile(value)
-        except TypeError: objfile = ""
-        
-        if objfile == filename:
+        if filename and _source_file(value) == filename:
             if inspect.isclass(value):
-                _unimport_class(value, ignores)
+                _unimport_class(value, batch)
                 
             elif inspect.isfunction(value):
-                _remove_refs(value, ignores)
+                batch.remove(value)
 
-    _remove_refs(old, ignores)
+    batch.remove(old)
 
 
 
-def _unimport_class(old, ignores):
+def _unimport_class(old, batch):
     """Remove traces of a class"""
     __internal_swaprefs_ignore__ = "unimport_class"    
     old_items = _safevars(old).items()
-    ignores += (id(old_items),)    
+    batch.ignore(old_items)
 
     for name, value in old_items:
         if name in ("__dict__", "__doc__", "__weakref__"):
             continue
 
         if inspect.isclass(value) and value.__module__ == old.__module__:
-            _unimport_class(value, ignores)
+            _unimport_class(value, batch)
             
         elif inspect.isfunction(value):
-            _remove_refs(value, ignores)
+            batch.remove(value)
 
-    _remove_refs(old, ignores)
+    batch.remove(old)
 
 
 
@@ -580,9 +2757,6 @@ class _MissingAllReference(object):
     
 
 
-_recursive_tuple_swap = set()
-
-
 def _bonus_containers():
     """Find additional container types, if they are loaded. Returns
         (deque, defaultdict).
@@ -591,137 +2765,434 @@ def _bonus_containers():
     deque = defaultdict = None
     collections = sys.modules.get("collections", None)
     if collections:
-        deque = getattr(collections, "collections", None)
+        deque = getattr(collections, "deque", None)
         defaultdict = getattr(collections, "defaultdict", None)
     return deque, defaultdict
 
 
 
-def _find_sequence_indices(container, value):
-    """Find indices of value in container. The indices will
-        be in reverse order, to allow safe editing.
+def _rewrite_sequence(items, news, removes):
+    """Copy a sequence with every batched object swapped or dropped in a
+        single pass. News maps id(old) to new, removes holds the ids of
+        objects to drop.
         """
-    indices = []
-    for i in range(len(container)-1, -1, -1):
-        if container[i] is value:
-            indices.append(i)
-    return indices
+    get = news.get
+    if removes:
+        return [get(id(item), item) for item in items if id(item) not in removes]
+    return [get(id(item), item) for item in items]
 
 
-def _swap_refs(old, new, ignores):
-    """Swap references from one object to another"""
-    __internal_swaprefs_ignore__ = "swap_refs"    
-    # Swap weak references
-    refs = weakref.getweakrefs(old)
-    if refs:
+
+# Marker for batched objects that have no replacement
+_removed = object()
+
+
+
+_sliced_types = (list, tuple, dict, set, frozenset)
+
+
+
+class _SwapBatch(object):
+    """Collects object swaps and removals so every referrer can be
+        patched with a single walk of the garbage collected heap,
+        instead of one walk per changed object.
+        """
+    def __init__(self, ignores=(), stats=None, scope=None, max_pause=None):
+        self.targets = {}   # id(old) -> old, for swaps and removals
+        self.news = {}      # id(old) -> new, for swaps only
+        self.ignores = set(ignores)
+        self.stats = stats if stats is not None else ReimportStats()
+        self.scope = scope
+        self.max_pause = max_pause
+        self._ignored = []
+        self._bonus = (None, None)
+        self._searched = None
+        self._resumed = 0.0
+
+
+    def ignore(self, container):
+        """Never patch this container. A reference is kept so its id
+            cannot be recycled before the batch is applied."""
+        self.ignores.add(id(container))
+        self._ignored.append(container)
+
+
+    def swap(self, old, new):
+        """Replace references to old with references to new"""
+        if old is new:
+            return
+        self.targets[id(old)] = old
+        self.news[id(old)] = new
+
+
+    def remove(self, old):
+        """Remove references to a discontinued object"""
+        # Ignore builtin immutables that keep no other references
+        if old is None or isinstance(old, (int, str, float, complex)):
+            return
+        if id(old) not in self.news:
+            self.targets[id(old)] = old
+
+
+    def _swap_weakrefs(self):
+        """Add weak references to swapped objects into the batch"""
+        for index, (key, new) in enumerate(list(self.news.items())):
+            if not index % _search_chunk_size:
+                yield from self._pause()
+            refs = weakref.getweakrefs(self.targets[key])
+            if not refs:
+                continue
+            try:
+                new_ref = weakref.ref(new)
+            except (TypeError, ValueError):
+                continue
+            for old_ref in refs:
+                self.swap(old_ref, new_ref)
+
+
+    def apply(self):
+        """Patch every referrer of the batched objects"""
+        for _ in self.steps():
+            time.sleep(0)
+
+
+    def steps(self):
+        """Patch every referrer of the batched objects. This generator
+            yields each time max_pause has been used up."""
+        if not self.targets:
+            return
+        self._resumed = time.perf_counter()
+        yield from self._swap_weakrefs()
+        self.stats.count("swapped", len(self.news))
+        self.stats.count("removed", len(self.targets) - len(self.news))
+
+        # Collections during the walk would tear down unreachable
+        # referrers while they are being patched
+        gc_enabled = gc.isenabled()
+        gc.disable()
         try:
-            new_ref = weakref.ref(new)
-        except ValueError:
-            pass
+            yield from self._apply_referrers()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+
+    def _apply_referrers(self):
+        """Patch referrers of the batched objects. Tuples cannot be patched
+            in place, so every tuple holding a batched object, or holding
+            such a tuple, goes on a worklist. Each is rebuilt exactly once,
+            then swapped into its own referrers along with the others.
+            """
+        __internal_swaprefs_ignore__ = "swap_batch"
+        targets = self.targets
+        news = self.news
+        removes = targets.keys() - news.keys()
+        tuples = {}     # id(old) -> old, every tuple to rebuild
+        for container in (targets, news, tuples):
+            self.ignore(container)
+        self._bonus = _bonus_containers()
+
+        others, holders = yield from self._search(tuples)
+        for container in others:
+            self._patch(container, targets, news, removes)
+            yield from self._pause()
+        container = others = None
+
+        rebuilt = yield from self._rebuild_tuples(tuples, news, removes)
+        self.stats.count("patched_tuple", len(rebuilt))
+        for container in holders:
+            self._patch(container, rebuilt, rebuilt, ())
+            yield from self._pause()
+
+
+    def search(self):
+        """Walk the heap the way steps() does, without patching anything.
+            Returns every container that would be patched or rebuilt."""
+        tuples = {}
+        self.ignore(self.targets)
+        self.ignore(tuples)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            steps = self._search(tuples)
+            while True:
+                try:
+                    next(steps)
+                except StopIteration as stop:
+                    others, holders = stop.value
+                    break
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return others + list(tuples.values()) + holders
+
+
+    def _search(self, tuples):
+        """Find the referrers of the batched objects. Tuples holding them,
+            at any depth, are added to tuples. Returns the other
+            referrers, and the other containers holding those tuples."""
+        # One walk for all batched objects
+        found, others = yield from self._walk_referrers(
+                            list(self.targets.values()), tuples)
+
+        # Tuples holding worklist tuples, at any depth, are searched for
+        # among the tuples of the heap alone. One more walk then finds
+        # the other containers holding worklist tuples.
+        holders = {}    # id(container) -> container, referring to those
+        self.ignore(holders)
+        while found:
+            yield from self._add_tuple_holders(tuples)
+            found, more = yield from self._walk_referrers(
+                              list(tuples.values()), tuples)
+            holders.update((id(c), c) for c in more)
+        return others, list(holders.values())
+
+
+    def _walk_referrers(self, objects, tuples):
+        """Walk the heap once for referrers of objects. Returns the tuples
+            not seen before, which are also added to tuples, and a list
+            of the other referrers."""
+        self.ignore(objects)
+        referrers = yield from self._get_referrers(objects)
+        self.ignore(referrers)
+        self.stats.count("referrers", len(referrers))
+        ignores = self.ignores
+        found = []
+        others = []
+        self.ignore(found)
+        for index, container in enumerate(referrers):
+            if not index % _search_chunk_size:
+                yield from self._pause()
+            if id(container) in ignores:
+                continue
+            if type(container) is tuple:
+                if id(container) not in tuples:
+                    tuples[id(container)] = container
+                    found.append(container)
+            else:
+                others.append(container)
+        return found, others
+
+
+    def _add_tuple_holders(self, tuples):
+        """Add the tuples holding worklist tuples to the worklist, until
+            none are left. Only the tuples of the heap are searched."""
+        searched = yield from self._snapshot()
+        ignores = self.ignores
+        candidates = []
+        self.ignore(candidates)
+        for start in range(0, len(searched), _search_chunk_size):
+            candidates.extend([container for container in
+                               searched[start:start + _search_chunk_size]
+                               if type(container) is tuple and
+                               id(container) not in tuples and
+                               id(container) not in ignores])
+            yield from self._pause()
+        worklist = tuples.keys()
+        while candidates:
+            remaining = []
+            for start in range(0, len(candidates), _search_chunk_size):
+                for container in candidates[start:start + _search_chunk_size]:
+                    if worklist.isdisjoint(map(id, container)):
+                        remaining.append(container)
+                    else:
+                        tuples[id(container)] = container
+                yield from self._pause()
+            if len(remaining) == len(candidates):
+                break
+            candidates[:] = remaining
+
+
+    def _snapshot(self):
+        """The objects searched for referrers, taken once per batch. These
+            are the scope's objects, or every object the gc tracks."""
+        if self._searched is None:
+            if self.scope is not None:
+                self._searched = self.scope.objects()
+            else:
+                self._searched = gc.get_objects()
+            self.ignore(self._searched)
+            yield from self._pause()
+        return self._searched
+
+
+    def _get_referrers(self, objects):
+        """Referrers of objects in the whole heap, or in the scope. A few
+            objects are left to gc.get_referrers. Otherwise, or with a
+            max_pause, a snapshot of the heap is searched in chunks."""
+        if (self.scope is None and self.max_pause is None and
+                len(objects) <= _direct_referrers_limit):
+            return gc.get_referrers(*objects)
+        searched = yield from self._snapshot()
+        ids = set(map(id, objects))
+        referrers = []
+        for start in range(0, len(searched), _search_chunk_size):
+            chunk = searched[start:start + _search_chunk_size]
+            if self.max_pause is None:
+                referrers.extend([container for container in chunk
+                                  if not ids.isdisjoint(map(id, gc.get_referents(container)))])
+                continue
+            # Large containers alone could take longer than max_pause
+            for container in chunk:
+                if (type(container) in _sliced_types and
+                        len(container) > _search_chunk_size):
+                    refers = yield from self._refers_sliced(container, ids)
+                else:
+                    refers = not ids.isdisjoint(map(id, gc.get_referents(container)))
+                if refers:
+                    referrers.append(container)
+            yield from self._pause()
+        return referrers
+
+
+    def _refers_sliced(self, container, ids):
+        """Whether a large list, tuple, dict or set refers to one of ids.
+            It is checked in slices, pausing in between. Dicts and sets
+            are copied to lists first."""
+        if type(container) is dict:
+            parts = (list(container), list(container.values()))
+        elif type(container) in (set, frozenset):
+            parts = (list(container),)
         else:
-            for old_ref in refs:
-                _swap_refs(old_ref, new_ref, ignores + (id(refs),))
-    del refs
+            parts = (container,)
+        for items in parts:
+            for start in range(0, len(items), _search_chunk_size):
+                if not ids.isdisjoint(map(id, items[start:start + _search_chunk_size])):
+                    return True
+                yield from self._pause()
+        return False
 
-    deque, defaultdict = _bonus_containers()
 
-    # Swap through garbage collector
-    referrers = gc.get_referrers(old)
-    for container in referrers:
-        if id(container) in ignores:
-            continue
-        container_type = type(container)
-        
-        if container_type is list or container_type is deque:
-            for index in _find_sequence_indices(container, old):
-                container[index] = new
-        
-        elif container_type is tuple:
-            # protect from recursive tuples
-            orig = container
-            if id(orig) in _recursive_tuple_swap:
+    def _pause(self):
+        """Yield to the caller once max_pause has been used up"""
+        if self.max_pause is None:
+            return
+        if time.perf_counter() - self._resumed < self.max_pause:
+            return
+        yield
+        self.stats.count("pauses")
+        self._resumed = time.perf_counter()
+
+
+    def _rebuild_tuples(self, tuples, news, removes):
+        """Rebuild every worklist tuple once, inner tuples before the ones
+            holding them. Returns id(old) -> rebuilt tuple."""
+        rebuilt = {}
+        building = set()
+        for index, old in enumerate(tuples.values()):
+            if not index % _search_chunk_size:
+                yield from self._pause()
+            if id(old) in rebuilt:
                 continue
-            _recursive_tuple_swap.add(id(orig))
-            try:
-                container = list(container)
-                for index in _find_sequence_indices(container, old):
-                    container[index] = new
-                container = tuple(container)
-                _swap_refs(orig, container, ignores + (id(referrers),))
-            finally:
-                _recursive_tuple_swap.remove(id(orig))
-        
+            stack = [old]
+            building.add(id(old))
+            while stack:
+                current = stack[-1]
+                pending = False
+                for item in current:
+                    key = id(item)
+                    if key in tuples and key not in rebuilt and key not in building:
+                        building.add(key)
+                        stack.append(item)
+                        pending = True
+                if pending:
+                    continue
+                stack.pop()
+                building.discard(id(current))
+
+                # Tuples still building are part of a cycle, kept as is
+                items = []
+                for item in current:
+                    key = id(item)
+                    if key in rebuilt:
+                        items.append(rebuilt[key])
+                    elif key in news:
+                        items.append(news[key])
+                    elif key not in removes:
+                        items.append(item)
+                rebuilt[id(current)] = tuple(items)
+        return rebuilt
+
+
+    def _patch(self, container, targets, news, removes):
+        """Patch one container that is not a tuple"""
+        deque, defaultdict = self._bonus
+        container_type = type(container)
+
+        if container_type is list:
+            container[:] = _rewrite_sequence(container, news, removes)
+            patched = "list"
+
+        elif container_type is deque:
+            items = _rewrite_sequence(container, news, removes)
+            container.clear()
+            container.extend(items)
+            patched = "list"
+
         elif container_type is dict or container_type is defaultdict:
-            if "__internal_swaprefs_ignore__" not in container:
-                try:
-                    if old in container:
-                        container[new] = container.pop(old)
-                except TypeError:  # Unhashable old value
-                    pass
-                for k,v in container.items():
-                    if v is old:
-                        container[k] = new
+            if "__internal_swaprefs_ignore__" in container:
+                return
+            for key, value in list(container.items()):
+                if id(value) in targets:
+                    value = news.get(id(value), _removed)
+                    if value is _removed:
+                        del container[key]
+                        continue
+                    container[key] = value
+                if id(key) in targets:
+                    del container[key]
+                    new = news.get(id(key), _removed)
+                    if new is not _removed:
+                        container[new] = value
+            patched = "dict"
 
         elif container_type is set:
-            container.remove(old)
-            container.add(new)
+            for item in [v for v in container if id(v) in targets]:
+                container.remove(item)
+                new = news.get(id(item), _removed)
+                if new is not _removed:
+                    container.add(new)
+            patched = "set"
 
         elif container_type is type:
-            if old in container.__bases__:
-                bases = list(container.__bases__)
-                bases[bases.index(old)] = new
-                container.__bases__ = tuple(bases)
-        
-        elif type(container) is old:
+            bases = container.__bases__
+            if not [b for b in bases if id(b) in news]:
+                return
+            container.__bases__ = tuple(news.get(id(b), b) for b in bases)
+            patched = "type"
+
+        elif id(container_type) in news:
             try:
-                container.__class__ = new
+                container.__class__ = news[id(container_type)]
             except TypeError:
                 # Type error happens on slotted classes
-                pass
-        
+                return
+            patched = "instance"
+
         elif container_type is _InstanceType:
-            if container.__class__ is old:
-                container.__class__ = new
+            new = news.get(id(container.__class__))
+            if new is None:
+                return
+            container.__class__ = new
+            patched = "instance"
 
-       
+        else:
+            return
 
-def _remove_refs(old, ignores):
-    """Remove references to a discontinued object"""
-    __internal_swaprefs_ignore__ = "remove_refs"
-    
-    # Ignore builtin immutables that keep no other references
-    if old is None or isinstance(old, (int, str, float, complex)):
-        return
+        self.stats.count("patched_" + patched)
 
-    deque, defaultdict = _bonus_containers()
-    
-    # Remove through garbage collector
-    for container in gc.get_referrers(old):
-        if id(container) in ignores:
-            continue
-        container_type = type(container)
 
-        if container_type is list or container_type is deque:
-            for index in _find_sequence_indices(container, old):
-                del container[index]
-        
-        elif container_type is tuple:
-            orig = container
-            container = list(container)
-            for index in _find_sequence_indices(container, old):
-                del container[index]
-            container = tuple(container)
-            _swap_refs(orig, container, ignores)
-        
-        elif container_type is dict or container_type is defaultdict:
-            if "__internal_swaprefs_ignore__" not in container:
-                try:
-                    container.pop(old, None)
-                except TypeError:  # Unhashable old value
-                    pass
-                for k,v in container.items():
-                    if v is old:
-                        del container[k]
 
-        elif container_type is set:
-            container.remove(old)
+def _swap_refs(old, new, ignores):
+    """Swap references from one object to another"""
+    batch = _SwapBatch(ignores)
+    batch.swap(old, new)
+    batch.apply()
+
+
+
+def _remove_refs(old, ignores):
+    """Remove references to a discontinued object"""
+    batch = _SwapBatch(ignores)
+    batch.remove(old)
+    batch.apply()
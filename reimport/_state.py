@@ -0,0 +1,88 @@
+"""
+Compact file holding the state of scanned source files, so one process
+can scan the disk for many others. Each write replaces the whole file
+atomically. Readers map a version of the file into memory once and only
+read it again after it has been replaced, so no locks are needed.
+"""
+
+
+import os
+import mmap
+import struct
+
+
+
+_MAGIC = b"REIMPST1"
+_header = struct.Struct("<8sQI")    # magic, generation, record count
+_record = struct.Struct("<dQ16sH")  # mtime, size, digest, filename length
+_no_digest = b"\0" * 16
+
+
+
+def write_state(filename, records, generation):
+    """Write a new version of the state file. Records maps a source
+        filename to (mtime, size, digest), the digest may be None."""
+    data = bytearray(_header.pack(_MAGIC, generation, len(records)))
+    for path, (mtime, size, digest) in sorted(records.items()):
+        encoded = os.fsencode(path)
+        data.extend(_record.pack(mtime, size, digest or _no_digest,
+                                 len(encoded)))
+        data.extend(encoded)
+
+    temp = "%s.%d.tmp" % (filename, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, filename)
+
+
+
+class StateReader(object):
+    """Reads the records of a state file, once per version written"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.generation = 0
+        self.records = {}
+        self._version = None
+
+
+    def refresh(self):
+        """Read the file again if it was replaced. Returns True when the
+            records changed."""
+        try:
+            f = open(self.filename, "rb")
+        except OSError:
+            return False
+        with f:
+            stat = os.fstat(f.fileno())
+            version = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if version == self._version or stat.st_size < _header.size:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                parsed = _parse(mapped)
+        if parsed is None:
+            return False
+        self._version = version
+        self.generation, self.records = parsed
+        return True
+
+
+
+def _parse(data):
+    """Generation and records of a mapped state file, None if invalid"""
+    magic, generation, count = _header.unpack_from(data, 0)
+    if magic != _MAGIC:
+        return None
+    records = {}
+    offset = _header.size
+    try:
+        for _ in range(count):
+            mtime, size, digest, length = _record.unpack_from(data, offset)
+            offset += _record.size
+            path = os.fsdecode(data[offset:offset + length])
+            offset += length
+            if digest == _no_digest:
+                digest = None
+            records[path] = (mtime, size, digest)
+    except struct.error:
+        return None
+    return generation, records
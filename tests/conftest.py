@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def module_dir(tmp_path):
+    """A temporary directory on sys.path for test modules. Modules
+        loaded from it are dropped from sys.modules afterwards."""
+    path = str(tmp_path)
+    sys.path.insert(0, path)
+    try:
+        yield tmp_path
+    finally:
+        sys.path.remove(path)
+        for name, module in list(sys.modules.items()):
+            filename = getattr(module, "__file__", None)
+            if isinstance(filename, str) and filename.startswith(path + os.sep):
+                del sys.modules[name]
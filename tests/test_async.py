@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+import reimport
+
+
+def test_reimport_async(module_dir):
+    source = module_dir / "asynced.py"
+    source.write_text("def func():\n    return 1\n")
+    import asynced
+    registry = [asynced.func] * 100000
+
+    time.sleep(1)
+    source.write_text("def func():\n    return 2\n")
+
+    async def ticker(ticks):
+        while True:
+            ticks.append(reimport.reload_barrier.reloading)
+            await asyncio.sleep(0)
+
+    async def main():
+        assert await reimport.modified_async(str(module_dir)) == ["asynced"]
+        ticks = []
+        task = asyncio.ensure_future(ticker(ticks))
+        stats = await reimport.reimport_async("asynced", max_pause=0.0001)
+        task.cancel()
+        return stats, ticks
+
+    stats, ticks = asyncio.run(main())
+    new = sys.modules["asynced"]
+    assert registry[-1] is new.func
+    assert stats.modules == ["asynced"]
+    assert list(stats.phases) == ["find", "precheck", "import",
+                                  "push_symbols", "rejigger", "swap"]
+    assert stats.counts["pauses"] > 0
+    assert any(ticks)
+
+
+def test_reimport_async_error(module_dir):
+    source = module_dir / "asyncbad.py"
+    source.write_text("value = 1\n")
+    import asyncbad
+    source.write_text("value = (\n")
+    try:
+        asyncio.run(reimport.reimport_async("asyncbad"))
+    except SyntaxError:
+        pass
+    else:
+        assert False, "SyntaxError not raised"
+    assert sys.modules["asyncbad"] is asyncbad
+
+
+def test_reimport_async_serialized(module_dir):
+    source = module_dir / "asyncpair.py"
+    source.write_text("def func():\n    return 1\n")
+    import asyncpair
+    registry = [asyncpair.func] * 100000
+    source.write_text("def func():\n    return 2\n")
+
+    async def main():
+        return await asyncio.gather(
+            reimport.reimport_async("asyncpair", max_pause=0.0001),
+            reimport.reimport_async("asyncpair", max_pause=0.0001))
+
+    first, second = asyncio.run(main())
+    new = sys.modules["asyncpair"]
+    assert registry[0] is new.func
+    assert registry[-1] is new.func
+    assert first.counts["pauses"] > 0 and second.counts["pauses"] > 0
+
+
+def test_lazy_imports():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys; sys.path.insert(0, %r); import reimport; "
+            "print(sorted(set(['asyncio', 'socket', 'concurrent.futures']) "
+            "& set(sys.modules)))" % repo)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.strip() == b"[]"
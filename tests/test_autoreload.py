@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+
+import reimport
+
+
+def test_autoreloader(module_dir):
+    first = module_dir / "autofirst.py"
+    second = module_dir / "autosecond.py"
+    first.write_text("VALUE = 1\n")
+    second.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(first, (past, past))
+    os.utime(second, (past, past))
+
+    batches = []
+    done = threading.Event()
+    def callback(names, elapsed, error):
+        batches.append((names, error))
+        done.set()
+
+    import autofirst
+    import autosecond
+
+    reloader = reimport.AutoReloader([str(module_dir)], debounce=0.3,
+                                     interval=0.1, callback=callback)
+    reloader.start()
+    try:
+        time.sleep(1)
+        first.write_text("VALUE = 2\n")
+        time.sleep(0.1)
+        second.write_text("VALUE = 2\n")
+        assert done.wait(5)
+    finally:
+        reloader.stop()
+
+    assert batches == [(["autofirst", "autosecond"], None)]
+    assert autofirst.VALUE == autosecond.VALUE == 2
+
+
+def test_autoreloader_errors(module_dir, monkeypatch):
+    from reimport import _reimport
+    source = module_dir / "autoflaky.py"
+    source.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(source, (past, past))
+    import autoflaky
+
+    # The first scan fails, the reloader carries on
+    scans = []
+    scan = _reimport.modified
+    def flaky(*args, **kwargs):
+        scans.append(args)
+        if len(scans) == 1:
+            raise RuntimeError("scan failed")
+        return scan(*args, **kwargs)
+    monkeypatch.setattr(_reimport, "modified", flaky)
+
+    batches = []
+    done = threading.Event()
+    def callback(names, elapsed, error):
+        batches.append((names, error))
+        if names:
+            done.set()
+
+    reloader = reimport.AutoReloader([str(module_dir)], debounce=0.1,
+                                     interval=0.1, callback=callback)
+    reloader.start()
+    try:
+        time.sleep(1)
+        source.write_text("VALUE = 2\n")
+        assert done.wait(5)
+    finally:
+        reloader.stop()
+
+    assert isinstance(batches[0][1], RuntimeError)
+    assert batches[0][0] == []
+    assert batches[-1] == (["autoflaky"], None)
+    assert autoflaky.VALUE == 2
+
+    # The running script is never a candidate
+    monkeypatch.setattr(_reimport, "modified", lambda **kwargs: ["__main__"])
+    monkeypatch.setitem(_reimport._module_index, "__main__", str(source))
+    assert reimport.AutoReloader()._collect(0) == set()
@@ -0,0 +1,103 @@
+import sys
+import time
+import threading
+
+import reimport
+from reimport._reimport import _SwapBatch
+
+
+def test_reload_barrier(module_dir):
+    source = module_dir / "barred.py"
+    source.write_text("def func():\n    return 1\n")
+    import barred
+    registry = [barred.func]
+    source.write_text("def func():\n    return 2\n")
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+                              reimport.reimport("barred")))
+    with reimport.reload_barrier:
+        thread.start()
+        time.sleep(0.2)
+        # The reimport waits for this thread to leave the barrier
+        assert thread.is_alive()
+        assert reimport.reload_barrier.reloading
+        assert registry[0]() == 1
+    thread.join(10)
+
+    assert results
+    assert not reimport.reload_barrier.reloading
+    assert reimport.reload_barrier.wait(0)
+    assert registry[0]() == 2
+
+
+def test_reimport_inside_barrier(module_dir):
+    source = module_dir / "barredtwice.py"
+    source.write_text("VALUE = 1\n")
+    import barredtwice
+    source.write_text("VALUE = 2\n")
+
+    results = []
+    def inside(started):
+        with reimport.reload_barrier:
+            started.wait()
+            results.append(reimport.reimport("barredtwice"))
+    def outside(started):
+        started.wait()
+        results.append(reimport.reimport("barredtwice"))
+
+    # Neither reimport may wait for the other thread to leave the barrier
+    for first, second in [(inside, outside), (inside, inside)] * 3:
+        started = threading.Barrier(2)
+        threads = [threading.Thread(target=target, args=(started,), daemon=True)
+                   for target in (first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert not any(thread.is_alive() for thread in threads)
+
+    assert len(results) == 12
+    assert not reimport.reload_barrier.reloading
+    assert barredtwice.VALUE == 2
+
+
+def test_max_pause(module_dir):
+    source = module_dir / "paused.py"
+    source.write_text("def func():\n    return 1\n\nclass Klass(object):\n    pass\n")
+    import paused
+    registry = [paused.func] * 1000
+    nested = {"pair": (paused.Klass, (paused.func,))}
+    instance = paused.Klass()
+
+    source.write_text("def func():\n    return 2\n\nclass Klass(object):\n    pass\n")
+    with reimport.reload_barrier:
+        # Reimport from inside the barrier does not wait for itself
+        stats = reimport.reimport("paused", max_pause=0.0001)
+
+    new = sys.modules["paused"]
+    assert registry == [new.func] * 1000
+    assert nested["pair"] == (new.Klass, (new.func,))
+    assert type(instance) is new.Klass
+    assert stats.counts["pauses"] > 0
+
+    # No step runs far past max_pause, even with many tuples to rebuild
+    # and a large list to search
+    def old():
+        pass
+    def new():
+        pass
+    holder = {"tuples": [(old, i) for i in range(50000)],
+              "large": [None] * 2000000, "small": [old]}
+    batch = _SwapBatch(max_pause=0.005)
+    batch.swap(old, new)
+    gaps = []
+    resumed = time.perf_counter()
+    for _ in batch.steps():
+        gaps.append(time.perf_counter() - resumed)
+        resumed = time.perf_counter()
+    gaps.append(time.perf_counter() - resumed)
+
+    assert holder["tuples"][-1] == (new, 49999)
+    assert holder["small"] == [new]
+    assert max(gaps) < 0.05
@@ -0,0 +1,59 @@
+import os
+import sys
+import importlib.util
+import concurrent.futures
+
+import reimport
+
+
+def test_write_bytecode(module_dir, monkeypatch):
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+    source = module_dir / "compiledonce.py"
+    source.write_text("VALUE = 1\n")
+    import compiledonce
+
+    source.write_text("VALUE = 22\n")
+    reimport.reimport("compiledonce", write_bytecode=True)
+    assert compiledonce.VALUE == 22
+    assert type(compiledonce.__loader__).__name__ == "SourceFileLoader"
+
+    # The cached file must be valid for a regular import. Same size
+    # and timestamp means the import trusts it over the source.
+    assert os.path.exists(importlib.util.cache_from_source(str(source)))
+    stats = os.stat(source)
+    source.write_text("VALUE = 33\n")
+    os.utime(source, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+    del sys.modules["compiledonce"]
+    import compiledonce
+    assert compiledonce.VALUE == 22
+
+
+def test_precheck_executor(module_dir):
+    package = module_dir / "precheckpkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("__package_reimport__ = True\n")
+    for name in "abcdef":
+        (package / ("mod_%s.py" % name)).write_text("VALUE = 1\n")
+    import precheckpkg.mod_a, precheckpkg.mod_b, precheckpkg.mod_c
+    import precheckpkg.mod_d, precheckpkg.mod_e, precheckpkg.mod_f
+
+    for name in "abcdef":
+        (package / ("mod_%s.py" % name)).write_text("VALUE = 2\n")
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        reimport.reimport("precheckpkg", executor=executor)
+    assert precheckpkg.mod_f.VALUE == 2
+
+    # The first broken module in reload order is always reported
+    for name in "bdf":
+        (package / ("mod_%s.py" % name)).write_text("VALUE = (\n")
+    reported = set()
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        for attempt in range(5):
+            try:
+                reimport.reimport("precheckpkg", executor=executor)
+            except SyntaxError as e:
+                reported.add(os.path.basename(e.filename))
+            else:
+                assert False, "SyntaxError not raised"
+    assert len(reported) == 1
+    assert precheckpkg.mod_b.VALUE == 2
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+import reimport
+
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+
+
+def test_canary(module_dir):
+    source = module_dir / "canarymod.py"
+    source.write_text("def func():\n    return 1\n")
+    import canarymod
+    func = canarymod.func
+    holder = [func]
+
+    # The module code raises, only the child saw it
+    source.write_text("def func():\n    return 2\nraise ValueError('broken')\n")
+    with pytest.raises(reimport.ReimportCanaryError) as info:
+        reimport.reimport("canarymod", canary=True)
+    assert "ValueError: broken" in info.value.error
+    assert info.value.stats is None
+    assert canarymod.func is func and func() == 1
+
+    # A failing callback would leave this process half reimported
+    source.write_text("def func():\n    return 3\n"
+                      "def __reimported__(old):\n    raise RuntimeError\n")
+    with pytest.raises(reimport.ReimportCanaryError) as info:
+        reimport.reimport("canarymod", canary=True)
+    assert info.value.stats["counts"]["callback_errors"] == 1
+    assert sys.modules["canarymod"] is canarymod and func() == 1
+
+    # Success in the child is applied here, with the child's timings
+    source.write_text("def func():\n    return 4\n")
+    stats = reimport.reimport("canarymod", canary=True)
+    assert list(stats.phases)[0] == "canary"
+    assert stats.canary["modules"] == ["canarymod"]
+    assert "swap" in stats.canary["phases"]
+    assert holder[0]() == 4
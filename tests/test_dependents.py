@@ -0,0 +1,42 @@
+import os
+
+import reimport
+
+
+def test_dependents(module_dir):
+    files = {
+        "depbase": "VALUE = 1\n",
+        "depuser": "import depbase\nDERIVED = depbase.VALUE * 10\n",
+        "depfrom": "from depuser import DERIVED\nfrom depuser import depbase\n"
+                   "def derived():\n    return DERIVED\n",
+        "depcaller": "from depfrom import derived\nRESULT = derived() + 1\n",
+        "depother": "VALUE = 1\n",
+    }
+    for name, text in files.items():
+        (module_dir / (name + ".py")).write_text(text)
+    import depbase, depuser, depfrom, depcaller, depother
+    assert depcaller.RESULT == 11
+
+    (module_dir / "depbase.py").write_text("VALUE = 2\n")
+    (module_dir / "depother.py").write_text("VALUE = 2\n")
+    reimport.reimport("depbase", dependents=True)
+
+    assert depuser.DERIVED == 20
+    assert depfrom.derived() == 20
+    assert depcaller.RESULT == 21
+    assert depother.VALUE == 1
+
+
+def test_dependency_sort():
+    from reimport._reimport import _dependency_sort, _module_imports
+    graph = {"a": set(["b"]), "b": set(["c.d"]), "c.d": set(), "c": set(["c.d"]),
+             "x": set(["y"]), "y": set(["x"])}
+    saved = dict(_module_imports)
+    _module_imports.clear()
+    _module_imports.update(graph)
+    try:
+        ordered = _dependency_sort(graph)
+    finally:
+        _module_imports.clear()
+        _module_imports.update(saved)
+    assert ordered == ["c.d", "b", "a", "c", "x", "y"]
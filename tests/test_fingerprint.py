@@ -0,0 +1,128 @@
+import sys
+
+import reimport
+
+
+ORIGINAL = '''
+def same(a, b=2):
+    return a + b
+
+def edited(a):
+    return a + 2
+
+class Base(object):
+    def method(self):
+        return 1
+
+class Sub(Base):
+    def method(self):
+        return super().method() + 1
+'''
+
+CHANGED = '''
+# Moved down a few lines
+
+
+def same(a, b=2):
+    return a + b
+
+def edited(a):
+    return a + 3
+
+class Base(object):
+    def method(self):
+        return 1
+
+class Sub(Base):
+    def method(self):
+        return super().method() + 2
+'''
+
+
+def test_skip_unchanged(module_dir):
+    source = module_dir / "printed.py"
+    source.write_text(ORIGINAL)
+    import printed
+    same, edited, Base, Sub = printed.same, printed.edited, printed.Base, printed.Sub
+    registry = [printed.same, printed.edited, printed.Base(), printed.Sub()]
+
+    source.write_text(CHANGED)
+    stats = reimport.reimport("printed", skip_unchanged=True)
+
+    new = sys.modules["printed"]
+    assert stats.counts["unchanged"] == 2
+    assert stats.counts["functions"] == 2
+    assert stats.counts["classes"] == 1
+    assert registry[1] is new.edited
+    assert registry[1](0) == 3
+    assert type(registry[3]) is new.Sub
+    assert registry[3].method() == 3
+    assert new.Sub.__bases__ == (new.Base,)
+
+    # Without globals the old objects are kept, with the new line numbers
+    assert registry[0] is same is new.same
+    assert type(registry[2]) is Base is new.Base
+    assert same.__code__.co_firstlineno == 5
+    assert Base.method.__code__.co_firstlineno == 12
+
+
+def test_skip_unchanged_counts(module_dir):
+    source = module_dir / "kept.py"
+    text = ("def handler(a):\n    return a + 1\n\n"
+            "class Row(object):\n    def __init__(self, value):\n"
+            "        self.value = value\n")
+    source.write_text(text)
+    import kept
+    handlers = [kept.handler] * 10
+    rows = [kept.Row(i) for i in range(100)]
+
+    source.write_text("\n" + text)
+    full = reimport.reimport("kept")
+    assert full.counts["patched_instance"] == 100
+    handler, Row = handlers[0], type(rows[0])
+
+    # Nothing refers to the new copies, the old objects are left alone
+    source.write_text("\n\n" + text)
+    skipped = reimport.reimport("kept", skip_unchanged=True)
+    assert skipped.counts["unchanged"] == 2
+    assert skipped.counts.get("patched_instance", 0) == 0
+    assert skipped.counts["referrers"] < full.counts["referrers"]
+    assert handlers == [handler] * 10
+    assert all(type(row) is Row for row in rows)
+    assert sys.modules["kept"].handler is handler
+    assert sys.modules["kept"].Row is Row
+    assert handler.__code__.co_firstlineno == 3
+
+
+def test_skip_unchanged_globals(module_dir):
+    source = module_dir / "counted.py"
+    source.write_text("counter = 0\n"
+                      "def incr():\n    global counter\n    counter += 1\n"
+                      "def get():\n    return counter\n")
+    import counted
+    registry = {"incr": counted.incr, "get": counted.get}
+
+    source.write_text("counter = 0\n"
+                      "def incr():\n    global counter\n    counter += 1\n"
+                      "def get():\n    return counter + 0\n")
+    stats = reimport.reimport("counted", skip_unchanged=True)
+    assert stats.counts["unchanged"] == 1
+
+    # The unchanged function rebinds the global of the live module
+    registry["incr"]()
+    registry["incr"]()
+    assert registry["get"]() == 2
+    assert sys.modules["counted"].counter == 2
+
+
+def test_fingerprint():
+    from reimport._reimport import _same_fingerprint
+
+    def make(value):
+        def inner(a, b=value):
+            return a + b
+        return inner
+
+    assert _same_fingerprint(make(1), make(1))
+    assert not _same_fingerprint(make(1), make(2))
+    assert not _same_fingerprint(make(1), lambda a, b=1: a + b)
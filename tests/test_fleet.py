@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import subprocess
+
+import reimport
+
+
+WORKER = '''
+import sys
+import time
+sys.path[:0] = [%r, %r]
+import fleetmod
+import reimport
+reimport.FleetWorker(%r, interval=0.05).start()
+while True:
+    time.sleep(0.05)
+'''
+
+
+def test_fleet(module_dir):
+    source = module_dir / "fleetmod.py"
+    source.write_text("def func():\n    return 1\n")
+    past = time.time() - 10
+    os.utime(str(source), (past, past))
+    address = str(module_dir / "fleet.sock")
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    coordinator = reimport.FleetCoordinator(address, timeout=20).start()
+    worker = subprocess.Popen([sys.executable, "-c",
+                               WORKER % (repo, str(module_dir), address)])
+    try:
+        import fleetmod
+        deadline = time.time() + 20
+        while coordinator.workers() < 1 and time.time() < deadline:
+            time.sleep(0.05)
+        assert coordinator.workers() == 1
+
+        # Nothing changed, nothing sent
+        assert coordinator.reload(path=str(module_dir)).reports == []
+
+        source.write_text("def func():\n    return 2\n")
+        report = coordinator.reload(path=str(module_dir))
+        assert report.modules == ["fleetmod"]
+        assert len(report.reports) == 1
+        assert report.failed() == []
+        assert report.reports[0]["pid"] == worker.pid
+        assert report.reports[0]["stats"]["modules"] == ["fleetmod"]
+        assert reimport.modified(str(module_dir)) == []
+        assert fleetmod.func() == 1
+
+        # Compile errors stop the reload before it reaches the workers
+        time.sleep(1)
+        source.write_text("def func(:\n")
+        try:
+            coordinator.reload(path=str(module_dir))
+        except SyntaxError:
+            pass
+        else:
+            assert False, "SyntaxError not raised"
+
+        # Errors running the module are rolled back in the worker
+        time.sleep(1)
+        source.write_text("def func():\n    return 3\nraise RuntimeError('boom')\n")
+        report = coordinator.reload(path=str(module_dir))
+        assert len(report.failed()) == 1
+        assert report.failed()[0]["error"] == "RuntimeError: boom"
+
+        # A reload nobody receives is kept for workers that connect later
+        coordinator.stop()
+        time.sleep(1)
+        source.write_text("def func():\n    return 4\n")
+        report = coordinator.reload(path=str(module_dir))
+        assert report.modules == ["fleetmod"]
+        assert report.reports == []
+        coordinator.start()
+        deadline = time.time() + 20
+        while coordinator.workers() < 1 and time.time() < deadline:
+            time.sleep(0.05)
+        report = coordinator.reload(path=str(module_dir))
+        assert report.modules == []
+        assert report.failed() == []
+        assert report.reports[0]["pid"] == worker.pid
+        assert report.reports[0]["stats"]["modules"] == ["fleetmod"]
+
+        # Caught up, nothing left to send
+        assert coordinator.reload(path=str(module_dir)).reports == []
+    finally:
+        worker.kill()
+        worker.wait()
+        coordinator.stop()
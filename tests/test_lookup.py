@@ -0,0 +1,67 @@
+import sys
+import types
+
+from reimport import _reimport
+
+
+def test_find_module_alias(monkeypatch):
+    module = types.ModuleType("lookup_original")
+    monkeypatch.setitem(sys.modules, "lookup_alias", module)
+
+    # Neither __spec__ nor __name__ is the loaded name, so the stale
+    # identity index has to be rebuilt
+    monkeypatch.setattr(_reimport, "_module_names", {id(module): "lookup_gone"})
+    assert _reimport._find_module_name(module) == "lookup_alias"
+    assert _reimport._module_names[id(module)] == "lookup_alias"
+    assert _reimport._find_exact_target(module) == ("lookup_alias", module)
+
+    monkeypatch.delitem(sys.modules, "lookup_alias")
+    assert _reimport._find_module_name(module) is None
+    assert _reimport._find_exact_target(module) == ("", None)
+
+
+def test_package_reimport_memo(monkeypatch):
+    package = types.ModuleType("lookup_pkg")
+    package.__package_reimport__ = True
+    child = types.ModuleType("lookup_pkg.child")
+    monkeypatch.setitem(sys.modules, "lookup_pkg", package)
+    monkeypatch.setitem(sys.modules, "lookup_pkg.child", child)
+
+    package_flags = {}
+    assert _reimport._find_exact_target("lookup_pkg.child", package_flags) == (
+                "lookup_pkg", package)
+    assert package_flags == {"lookup_pkg": True}
+
+    # Later lookups in the same reimport trust the memo
+    del package.__package_reimport__
+    assert _reimport._find_exact_target(child, package_flags) == (
+                "lookup_pkg", package)
+    package_flags["lookup_pkg"] = False
+    assert _reimport._find_exact_target(child, package_flags) == (
+                "lookup_pkg.child", child)
+    assert _reimport._find_exact_target(child) == ("lookup_pkg.child", child)
+
+
+def test_find_reloading_modules(monkeypatch):
+    index = {
+        "pk": "pk.py",
+        "pkg": "pkg/__init__.py",
+        "pkg-x": "pkg-x.py",
+        "pkg.a": "pkg/a.py",
+        "pkg.a.b": "pkg/a/b.py",
+        "pkg.builtin": None,
+        "pkg.z": "pkg/z.py",
+        "pkg0": "pkg0.py",
+        "pkg_x": "pkg_x.py",
+        "pkgx": "pkgx.py",
+        "pkgx.a": "pkgx/a.py",
+    }
+    monkeypatch.setattr(_reimport, "_module_index", index)
+    monkeypatch.setattr(_reimport, "_sorted_module_names", sorted(index))
+
+    # Children and grandchildren with a source, no siblings sharing the prefix
+    assert _reimport._find_reloading_modules("pkg") == [
+                "pkg", "pkg.a", "pkg.a.b", "pkg.z"]
+    assert _reimport._find_reloading_modules("pkg.a") == ["pkg.a", "pkg.a.b"]
+    assert _reimport._find_reloading_modules("pkgx") == ["pkgx", "pkgx.a"]
+    assert _reimport._find_reloading_modules("pk") == ["pk"]
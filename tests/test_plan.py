@@ -0,0 +1,109 @@
+import sys
+
+import reimport
+from reimport._reimport import _direct_referrers_limit
+
+
+ORIGINAL = '''
+def same(a):
+    return a + 1
+
+def edited(a):
+    return a + 2
+
+def dropped():
+    pass
+
+class Klass(object):
+    value = 1
+    def method(self):
+        return self.value
+
+class Other(object):
+    value = 1
+    def method(self):
+        return self.value
+'''
+
+CHANGED = '''
+def same(a):
+    return a + 1
+
+def edited(a):
+    return a + 3
+
+def fresh():
+    pass
+
+class Klass(object):
+    value = 1
+    def method(self):
+        return self.value
+
+class Other(object):
+    value = 2
+    def method(self):
+        return self.value
+'''
+
+
+def test_plan_reimport(module_dir):
+    source = module_dir / "planned.py"
+    source.write_text(ORIGINAL)
+    import planned
+    registry = [planned.edited, planned.edited, planned.Other()]
+    edited = planned.edited
+
+    source.write_text(CHANGED)
+    plan = reimport.plan_reimport("planned")
+
+    assert plan.modules == ["planned"]
+    assert sorted(plan.changed) == ["planned.Other", "planned.edited"]
+    assert sorted(plan.unchanged) == ["planned.Klass", "planned.same"]
+    assert plan.added == ["planned.fresh"]
+    assert plan.removed == ["planned.dropped"]
+    assert plan.errors == {}
+    assert plan.referrers["planned.edited"] >= 1
+    assert plan.referrers["planned.Other"] >= 1
+    assert "planned.Klass.method" in plan.referrers
+    assert plan.pause > 0
+    assert plan.as_dict()["removed"] == ["planned.dropped"]
+
+    # Nothing was changed
+    assert sys.modules["planned"] is planned
+    assert planned.edited is edited
+    assert planned.edited(0) == 2
+    assert registry[0] is edited
+
+
+def test_plan_reimport_error(module_dir):
+    source = module_dir / "planbad.py"
+    source.write_text("value = 1\n")
+    import planbad
+    source.write_text("value = (\n")
+    plan = reimport.plan_reimport("planbad")
+    assert list(plan.errors) == ["planbad"]
+    assert plan.errors["planbad"].startswith("SyntaxError")
+
+
+def test_plan_reimport_search(module_dir, monkeypatch):
+    import gc
+    source = module_dir / "plansearch.py"
+    source.write_text("".join("def f%d():\n    pass\n" % i for i in range(20)))
+    import plansearch
+    registry = [plansearch.f0] * 3
+    nested = ((plansearch.f1,),)
+
+    # Large batches search a snapshot of the heap, like the swap phase.
+    # Only the few nested tuples go to gc.get_referrers.
+    calls = []
+    get_referrers = gc.get_referrers
+    def counted(*objects):
+        calls.append(len(objects))
+        return get_referrers(*objects)
+    monkeypatch.setattr(gc, "get_referrers", counted)
+    plan = reimport.plan_reimport("plansearch")
+    assert max(calls, default=0) <= _direct_referrers_limit
+    assert plan.referrers["plansearch.f0"] >= 1
+    assert plan.referrers["plansearch.f1"] >= 1
+    assert plan.pause > 0
@@ -0,0 +1,188 @@
+import sys
+import gc
+import collections
+
+import pytest
+
+import reimport
+from reimport._reimport import _SwapBatch
+
+
+class OldBase(object):
+    pass
+
+class NewBase(object):
+    pass
+
+def old_func():
+    pass
+
+def new_func():
+    pass
+
+def gone_func():
+    pass
+
+
+def test_swap_batch():
+    class Derived(OldBase):
+        pass
+
+    inst = OldBase()
+    listed = [old_func, 1, old_func, gone_func]
+    tupled = (old_func, gone_func, OldBase)
+    nested = [tupled]
+    mapped = {old_func: old_func, "gone": gone_func}
+    setted = set([old_func, gone_func])
+    queued = collections.deque([gone_func, old_func])
+    registry = [old_func, gone_func, OldBase] * 1000
+
+    batch = _SwapBatch()
+    batch.swap(old_func, new_func)
+    batch.swap(OldBase, NewBase)
+    batch.remove(gone_func)
+    batch.apply()
+
+    assert listed == [new_func, 1, new_func]
+    assert nested[0] == (new_func, NewBase)
+    assert mapped == {new_func: new_func}
+    assert setted == set([new_func])
+    assert list(queued) == [new_func]
+    assert registry == [new_func, NewBase] * 1000
+    assert Derived.__bases__ == (NewBase,)
+    assert type(inst) is NewBase
+
+
+def test_swap_nested_tuples():
+    def old():
+        pass
+    def new():
+        pass
+
+    inner = (old, 1)
+    shared = (inner, inner)
+    deep = (old,)
+    for _ in range(2000):
+        deep = (deep, old)
+    chain = (inner,)
+    for _ in range(50):
+        chain = (chain,)
+    holder = {"shared": shared, "deep": deep, "inner": inner, "chain": chain}
+
+    batch = _SwapBatch()
+    batch.swap(old, new)
+    batch.apply()
+
+    assert holder["inner"] == (new, 1)
+    assert holder["shared"] == ((new, 1), (new, 1))
+    assert holder["shared"][0] is holder["shared"][1]
+    assert holder["shared"][0] is holder["inner"]
+    deep = holder["deep"]
+    while len(deep) == 2:
+        assert deep[1] is new
+        deep = deep[0]
+    assert deep == (new,)
+    chain = holder["chain"]
+    while len(chain) == 1:
+        chain = chain[0]
+    assert chain is holder["inner"]
+    assert batch.stats.counts["patched_tuple"] == 2 + 2001 + 51
+
+
+def test_reimport_stats(module_dir):
+    source = module_dir / "statted.py"
+    source.write_text("def func():\n    return 1\n\nclass Klass(object):\n    pass\n")
+    import statted
+    registry = [statted.func]
+    instance = statted.Klass()
+
+    source.write_text("def func():\n    return 2\n\nclass Klass(object):\n    pass\n")
+    stats = reimport.reimport("statted")
+
+    assert registry[0]() == 2
+    assert stats.modules == ["statted"]
+    assert list(stats.phases) == ["find", "precheck", "import",
+                                  "push_symbols", "rejigger", "swap"]
+    assert stats.total() == sum(stats.phases.values())
+    assert stats.counts["modules"] == 1
+    assert stats.counts["classes"] == 1
+    assert stats.counts["functions"] == 1
+    assert stats.counts["patched_list"] == 1
+    assert stats.counts["patched_instance"] == 1
+    assert stats.counts["referrers"] >= 2
+
+
+def test_reimport_scope(module_dir):
+    source = module_dir / "scoped.py"
+    source.write_text("def func():\n    return 1\n\nclass Klass(object):\n    pass\n")
+    import scoped
+    registry = {"handlers": [scoped.func], "objects": [scoped.Klass()]}
+    outside = [scoped.func]
+
+    source.write_text("def func():\n    return 2\n\nclass Klass(object):\n    pass\n")
+    stats = reimport.reimport("scoped", scope=[registry])
+
+    new = sys.modules["scoped"]
+    assert registry["handlers"][0] is new.func
+    assert type(registry["objects"][0]) is new.Klass
+    assert outside[0] is not new.func
+    assert stats.counts["referrers"] < 10
+
+
+def test_scope_generation():
+    def old():
+        pass
+    def new():
+        pass
+    holder = [old]
+    gc.collect()
+    young = [old]
+
+    batch = _SwapBatch(scope=reimport.ReimportScope(generation=0))
+    batch.swap(old, new)
+    batch.apply()
+    assert young == [new]
+    assert holder == [old]
+
+
+def test_scope_generation_version(monkeypatch):
+    monkeypatch.setattr(sys, "version_info", (3, 7, 9))
+    with pytest.raises(ValueError):
+        reimport.ReimportScope(generation=0)
+    assert reimport.ReimportScope([]).generation is None
+
+
+def test_track_instances(module_dir):
+    source = module_dir / "tracked.py"
+    template = ("import reimport\n\n@reimport.track_instances\n"
+                "class Row(object):\n    def __init__(self, value):\n"
+                "        self.value = value\n    def get(self):\n"
+                "        return self.value + %d\n\n"
+                "class SubRow(Row):\n    pass\n")
+    source.write_text(template % 0)
+    import tracked
+    rows = [tracked.Row(i) for i in range(25)]
+    sub = tracked.SubRow(100)
+    assert len(tracked.Row.__reimport_instances__) == 25
+    assert len(tracked.SubRow.__reimport_instances__) == 1
+
+    source.write_text(template % 1000)
+    stats = reimport.reimport("tracked")
+
+    new = sys.modules["tracked"]
+    assert all(type(row) is new.Row for row in rows)
+    assert rows[3].get() == 1003
+    assert type(sub) is new.SubRow
+    assert len(new.Row.__reimport_instances__) == 25
+    assert stats.counts["patched_instance"] == 26
+
+
+def test_from_file():
+    from reimport._reimport import _from_file
+    sibling = compile("def func(): pass", "/src/module.pyx", "exec")
+    namespace = {}
+    exec(sibling, namespace)
+    assert not _from_file("/src/module.py", namespace["func"])
+    assert _from_file(__file__, test_from_file)
+    assert _from_file(__file__, OldBase)
+    assert not _from_file(__file__, 12)
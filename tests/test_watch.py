@@ -0,0 +1,194 @@
+import os
+import time
+
+import reimport
+
+
+def test_watcher(module_dir):
+    source = module_dir / "watched.py"
+    source.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(str(source), (past, past))
+    import watched
+
+    watcher = reimport.Watcher().start()
+    try:
+        # The first call scans, files changed by other tests included
+        assert "watched" not in watcher.pending(timeout=0.2)
+
+        time.sleep(1)
+        source.write_text("VALUE = 2\n")
+        assert watcher.pending(timeout=5) == ["watched"]
+
+        reimport.reimport("watched")
+        assert watched.VALUE == 2
+        assert reimport.modified() == []
+    finally:
+        watcher.stop()
+
+
+def test_watcher_start(module_dir):
+    source = module_dir / "early.py"
+    source.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(str(source), (past, past))
+    import early
+    assert reimport.modified(str(module_dir)) == []
+
+    # Edited before the watcher started
+    time.sleep(1)
+    source.write_text("VALUE = 2\n")
+    watcher = reimport.Watcher().start()
+    try:
+        assert reimport.modified(str(module_dir)) == ["early"]
+    finally:
+        watcher.stop()
+
+
+def test_watcher_start_paths(module_dir, monkeypatch):
+    from reimport import _reimport
+    sources = []
+    past = time.time() - 10
+    for package in ("startone", "starttwo"):
+        (module_dir / package).mkdir()
+        for name in ("__init__.py", "mod.py"):
+            (module_dir / package / name).write_text("VALUE = 1\n")
+            os.utime(str(module_dir / package / name), (past, past))
+        sources.append(module_dir / package / "mod.py")
+    import startone.mod, starttwo.mod
+    assert reimport.modified(str(module_dir)) == []
+
+    scans = []
+    scan = _reimport._scan_modified
+    def counted(*args):
+        scans.append(args)
+        return scan(*args)
+    monkeypatch.setattr(_reimport, "_scan_modified", counted)
+
+    # Edited before the watcher started, found by a single scan
+    time.sleep(1)
+    for source in sources:
+        source.write_text("VALUE = 2\n")
+    watcher = reimport.Watcher().start()
+    try:
+        assert reimport.modified(str(module_dir / "startone")) == ["startone.mod"]
+        assert reimport.modified(str(module_dir / "starttwo")) == ["starttwo.mod"]
+        for _ in range(3):
+            reimport.modified(str(module_dir / "startone"))
+        if not watcher.polling():
+            assert len(scans) == 1
+    finally:
+        watcher.stop()
+
+
+def test_content_hash(module_dir):
+    source = module_dir / "hashed.py"
+    source.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(str(source), (past, past))
+    import hashed
+    assert reimport.modified(str(module_dir), content_hash=True) == []
+
+    # Only the timestamp moves
+    future = time.time() + 10
+    os.utime(str(source), (future, future))
+    assert reimport.modified(str(module_dir)) == ["hashed"]
+    assert reimport.modified(str(module_dir), content_hash=True) == []
+    assert reimport.modified(str(module_dir)) == []
+
+    # Same size, different contents
+    source.write_text("VALUE = 2\n")
+    os.utime(str(source), (future + 10, future + 10))
+    assert reimport.modified(str(module_dir), content_hash=True) == ["hashed"]
+
+    reimport.reimport("hashed")
+    assert hashed.VALUE == 2
+    os.utime(str(source), (future + 20, future + 20))
+    assert reimport.modified(str(module_dir), content_hash=True) == []
+
+
+def test_shared_state(module_dir):
+    source = module_dir / "shared.py"
+    source.write_text("VALUE = 1\n")
+    past = time.time() - 10
+    os.utime(str(source), (past, past))
+    state_file = str(module_dir / "reimport.state")
+    import shared
+    scanner = reimport.SharedState(state_file)
+    scanner.publish()
+
+    reader = reimport.SharedState(state_file, interval=0.05).start()
+    try:
+        assert reimport.modified(str(module_dir)) == []
+
+        # Nothing is seen until the scanner publishes again
+        source.write_text("VALUE = 2\n")
+        assert reimport.modified(str(module_dir)) == []
+        scanner.publish()
+        assert reimport.modified(str(module_dir)) == ["shared"]
+        assert reader.pending(str(module_dir), timeout=0.1) == ["shared"]
+
+        reimport.reimport("shared")
+        assert shared.VALUE == 2
+        assert reimport.modified(str(module_dir), content_hash=True) == []
+
+        # A touched file with the same contents
+        future = time.time() + 10
+        os.utime(str(source), (future, future))
+        scanner.publish()
+        assert reimport.modified(str(module_dir), content_hash=True) == []
+    finally:
+        reader.stop()
+
+
+def test_bytecode_baseline(module_dir):
+    import py_compile
+    import importlib.util
+
+    reimport.modified()
+    time.sleep(1.1)
+    source = module_dir / "cachedmod.py"
+    source.write_text("VALUE = 1\n")
+    py_compile.compile(str(source), importlib.util.cache_from_source(str(source)),
+                       invalidation_mode=py_compile.PycInvalidationMode.TIMESTAMP)
+    import cachedmod
+    # Newer than the previous scan, but the same source as compiled
+    assert reimport.modified(str(module_dir)) == []
+
+    time.sleep(1)
+    source.write_text("VALUE = 22\n")
+    assert reimport.modified(str(module_dir)) == ["cachedmod"]
+
+
+def test_scan_while_importing(module_dir):
+    import importlib
+    import threading
+
+    # Modules from new directories enter the index from one thread
+    # while another thread scans it
+    errors = []
+    stopping = threading.Event()
+    def scan():
+        try:
+            while not stopping.is_set():
+                reimport.modified()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=scan, daemon=True)
+    thread.start()
+    try:
+        for i in range(40):
+            package = module_dir / ("scanpkg%d" % i)
+            package.mkdir()
+            (package / "__init__.py").write_text("")
+            for name in "abcde":
+                (package / ("mod_%s.py" % name)).write_text("VALUE = 1\n")
+            importlib.invalidate_caches()
+            for name in "abcde":
+                importlib.import_module("scanpkg%d.mod_%s" % (i, name))
+                reimport.modified()
+    finally:
+        stopping.set()
+        thread.join(10)
+    assert errors == []